@@ -1,10 +1,20 @@
 import streamlit as st
+from streamlit.errors import StreamlitAPIException
 import os
 import time
+import uuid
 import base64
 import pandas as pd
-from audio_manager import create_trial_audio, get_calibration_audio, get_digit_b64
+from audio_manager import create_trial_audio, get_calibration_audio, get_digit_b64, build_probe_table, use_stimulus_bank
 from experiment_logic import ExperimentLogic
+from timing_component import play_trial_audio, probe_response
+from segment_splicer import SegmentBank
+from stream_server import start_stream_server, trial_stream_url, trial_duration_ms
+from render_service import RenderService, URGENT, LOOKAHEAD
+from results_store import ResultsStore, DEFAULT_DB_NAME
+from vocabulary import GRID_MAX_ITEMS, get_vocabulary, list_vocabularies
+from seeding import ROOT_SEED_BITS, trial_random, trial_seed_of
+import metrics
 
 # Page Setup
 st.set_page_config(
@@ -14,6 +24,104 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+@st.cache_resource
+def load_stimulus_bank():
+    # Memory-mapped clips/noise shared across server processes, if built (python stimulus_bank.py)
+    return use_stimulus_bank()
+
+load_stimulus_bank()
+
+@st.cache_resource
+def load_probe_table(vocab_name, lang):
+    # Probe payloads are built once per server process and language; RESPONSE reruns only look them up.
+    # Large vocabularies are left to load item by item as trials need them.
+    vocab = get_vocabulary(vocab_name)
+    if len(vocab) <= GRID_MAX_ITEMS:
+        build_probe_table(vocab.items, [lang])
+    return vocab_name
+
+@st.cache_resource
+def load_segment_bank(lang, isi_ms, retention_ms, items):
+    # Pre-encoded trial pieces, shared by all sessions with the same settings
+    return SegmentBank(lang, isi_ms, retention_ms, digits=items)
+
+@st.cache_resource
+def load_render_service():
+    # Process pool shared by every session on this server
+    return RenderService()
+
+@st.cache_resource
+def load_results_store(path):
+    # One connection per database per server process; stations share the file
+    return ResultsStore(path)
+
+@st.cache_resource
+def load_stream_server():
+    # One streaming endpoint per server process, next to the Streamlit app.
+    # Another process on this host may hold the port: then this one takes a free port.
+    try:
+        return start_stream_server()
+    except OSError:
+        pass
+    try:
+        return start_stream_server(port=0)
+    except OSError as e:
+        print(f"Streaming endpoint not started: {e}")
+        return None
+
+# Sessions not seen for this long (s) no longer count as active
+SESSION_IDLE_S = 300
+AUDIO_WAIT_SECONDS = metrics.histogram('amt_audio_wait_seconds', "Time from the AUDITORY phase to audio ready to send, by render mode")
+AUTOSAVE_SECONDS = metrics.histogram('amt_autosave_seconds', "Time to save one answered trial, by backend")
+AUTOSAVE_WRITES = metrics.counter('amt_autosave_writes_total', "Trial autosaves, by backend and outcome")
+RENDER_FALLBACKS = metrics.counter('amt_render_fallbacks_total', "Trials rendered in the script thread because the render service failed or timed out")
+# How long the AUDITORY phase waits for the render service before rendering the trial itself (s)
+RENDER_TIMEOUT_S = 20
+
+@st.cache_resource
+def load_metrics_server():
+    # Local /metrics endpoint (AMT_METRICS_HOST/AMT_METRICS_PORT), one per server process.
+    # A process that finds the port taken serves on another one, printed here for the scraper.
+    try:
+        server = metrics.start_metrics_server()
+        host, port = server.server_address[:2]
+        print(f"Metrics at http://{host}:{port}/metrics")
+        return server
+    except OSError as e:
+        print(f"Metrics endpoint not started: {e}")
+        return None
+
+@st.cache_resource
+def load_session_tracker():
+    # session_id -> (status, phase, last seen), read by the session gauges at scrape time
+    sessions = {}
+
+    def count(mid_trial):
+        cutoff = time.time() - SESSION_IDLE_S
+        n = 0
+        for session_id, (status, phase, seen) in list(sessions.items()):
+            if seen < cutoff:
+                sessions.pop(session_id, None)
+            elif not mid_trial or (status in ['PRACTICE', 'MAIN'] and phase in ['FIXATION', 'AUDITORY', 'RESPONSE']):
+                n += 1
+        return n
+
+    metrics.gauge('amt_active_sessions', "Sessions seen in the last SESSION_IDLE_S seconds").set_function(lambda: count(False))
+    metrics.gauge('amt_sessions_mid_trial', "Active sessions inside a trial (fixation, audio or response)").set_function(lambda: count(True))
+
+    service = load_render_service()
+    queue_depth = metrics.gauge('amt_render_queue_depth', "Render jobs waiting, by priority")
+    queue_depth.set_function(lambda: service.metrics()['queue_depth_urgent'], priority='urgent')
+    queue_depth.set_function(lambda: service.metrics()['queue_depth_lookahead'], priority='lookahead')
+    metrics.gauge('amt_render_running', "Render jobs running in the worker pool").set_function(lambda: service.metrics()['running'])
+    metrics.gauge('amt_render_queue_wait_p95_seconds', "95th percentile queue wait over the last render jobs").set_function(lambda: service.metrics()['wait_ms_p95'] / 1000)
+    return sessions
+
+def track_session():
+    load_session_tracker()[st.session_state.session_id] = (st.session_state.status, st.session_state.phase, time.time())
+
+load_metrics_server()
+
 # Custom CSS for Aesthetics
 st.markdown("""
 <style>
@@ -103,31 +211,40 @@ with st.sidebar.expander("👤 Subject & Session", expanded=True):
 # 2. Stimuli & Language
 digits_avail = []
 with st.sidebar.expander("🎛️ Stimuli & Language", expanded=False):
-    st.write("Selected Digits:")
-    cols = st.columns(3)
-    for i in range(1, 10):
-        with cols[(i-1)%3]:
-            if st.checkbox(f"{i}", value=True, key=f"digit_{i}"):
-                digits_avail.append(i)
+    vocab_name = st.selectbox("Stimuli", list_vocabularies(), help="Digits, letters, or a word list from assets/vocabularies/<name>.txt (one item per line)")
+    vocab = get_vocabulary(vocab_name)
+    st.write(f"Selected {vocab.name}:")
+    if len(vocab) <= GRID_MAX_ITEMS:
+        cols = st.columns(3)
+        for i, item in enumerate(vocab):
+            with cols[i % 3]:
+                if st.checkbox(f"{item}", value=True, key=f"item_{vocab.name}_{item}"):
+                    digits_avail.append(item)
+    else:
+        digits_avail = st.multiselect(f"{len(vocab)} items", vocab.items, default=vocab.items, label_visibility="collapsed")
     
     lang = st.radio("Language", ["English", "Hebrew", "Arabic", "Amharic"], index=1)
     
     # Test Voice
-    if st.button("🔊 Test Voice (Digit '1')"):
-        test_digit_b64 = get_digit_b64(1, lang)
+    if st.button(f"🔊 Test Voice ({vocab.noun.capitalize()} '{vocab.items[0]}')"):
+        test_digit_b64 = get_digit_b64(vocab.items[0], lang)
         if test_digit_b64:
             st.markdown(f'<audio autoplay><source src="data:audio/mp3;base64,{test_digit_b64}" type="audio/mp3"></audio>', unsafe_allow_html=True)
         else:
             st.error("Could not generate audio.")
 
 if not digits_avail:
-    st.sidebar.error("Select at least one digit.")
+    st.sidebar.error("Select at least one item.")
     st.stop()
 
+load_probe_table(vocab_name, lang)
+
 # 3. Timing
 with st.sidebar.expander("⏱️ Timing", expanded=False):
     isi = st.slider("Inter-Stimulus Interval (sec)", 0.1, 2.0, 0.8, 0.1)
     retention = st.slider("Retention Phase (sec)", 0.5, 5.0, 2.0, 0.5)
+    stream_audio = st.checkbox("Stream trial audio (local endpoint)", value=False, help="Playback starts while the trial is still being rendered. The endpoint listens on AMT_STREAM_HOST (127.0.0.1 by default), so the browser must run on this machine.")
+    fast_render = st.checkbox("Fast render (pre-encoded segments)", value=False, help="Assemble trials from pre-encoded MP3 frames instead of mixing each trial. Durations are rounded to 26 ms frames.")
 
 # 4. Calibration
 with st.sidebar.expander("📢 Calibration & Noise", expanded=False):
@@ -136,7 +253,7 @@ with st.sidebar.expander("📢 Calibration & Noise", expanded=False):
     st.write("---")
     st.caption("Continuous Noise Only")
     if st.button(f"Play Noise Only ({calib_snr}dB SNR Level)"):
-        calib_b64 = get_calibration_audio(snr_db=calib_snr, duration_sec=10)
+        calib_b64 = get_calibration_audio(snr_db=calib_snr, duration_sec=10, lang=lang)
         audio_html = f'<audio autoplay controls><source src="data:audio/mp3;base64,{calib_b64}" type="audio/mp3"></audio>'
         st.markdown(f"Playing {calib_snr}dB SNR Noise...")
         st.markdown(audio_html, unsafe_allow_html=True)
@@ -165,6 +282,7 @@ with st.sidebar.expander("📢 Calibration & Noise", expanded=False):
     st.write("---")
     num_practice = st.number_input("Number of Practice Trials", 0, 20, 1)
     randomize_order = st.checkbox("Randomize Trial Order (Main Exp)", value=False, help="Check to shuffle. Uncheck for structured order (0->5->10 SNR)")
+    seed_text = st.text_input("Random Seed", value="", help="Leave empty for a new seed per session. The seed is saved with every trial; the same seed and session number give the same trials and noise.")
 
 # 5. Data Output
 with st.sidebar.expander("📂 Data Output", expanded=False):
@@ -175,6 +293,10 @@ with st.sidebar.expander("📂 Data Output", expanded=False):
             os.makedirs(output_dir)
         except:
             pass 
+    results_backend = st.radio(
+        "Save Trials To", ["CSV files", "SQLite database"],
+        help=f"SQLite: every station writes to {DEFAULT_DB_NAME} in the output path (needs a local disk, not a synced folder). The final CSV is exported from it."
+    )
 
 # 6. About
 st.sidebar.markdown("---")
@@ -199,9 +321,22 @@ if 'status' not in st.session_state:
     st.session_state.phase = 'IDLE' # IDLE, FIXATION, AUDITORY, RESPONSE, FEEDBACK
     st.session_state.last_correct = False
     st.session_state.start_time = 0
+    st.session_state.audio_sent_time = 0
+    st.session_state.session_id = uuid.uuid4().hex
+    st.session_state.render_jobs = {} # trial_key -> (render params, Future)
+
+track_session()
 
 def start_experiment():
-    logic = ExperimentLogic(subject_id, session_num, digits_avail, age)
+    """Generates the session's trials and starts the practice block; False if the settings are invalid."""
+    try:
+        seed = int(seed_text) if seed_text.strip() else None
+        if seed is not None and not 0 <= seed < 2 ** ROOT_SEED_BITS:
+            raise ValueError
+    except ValueError:
+        st.error(f"Random Seed must be a whole number from 0 to 2^{ROOT_SEED_BITS} - 1 (or empty).")
+        return False
+    logic = ExperimentLogic(subject_id, session_num, digits_avail, age, vocabulary=vocab, seed=seed)
     # Generate trials: 3 Loads (2,4,6) x 3 SNRs x 22 Reps = 198 trials
     practice, main = logic.generate_trials(
         loads=[2,4,6], 
@@ -218,8 +353,15 @@ def start_experiment():
     st.session_state.status = 'PRACTICE'
     st.session_state.current_trial_idx = 0
     st.session_state.phase = 'IDLE'
+    # Distinguishes browser-side component state between runs in the same session
+    st.session_state.run_id = logic.run_id
+    st.session_state.results = []
+    st.session_state.pop('final_path', None)
+    st.session_state.pop('results_db', None)
+    st.session_state.pop('autosave_path', None)
+    return True
 
-def submit_response(response_bool, rt):
+def submit_response(response_bool, rt, client_timing=None):
     current_trial = st.session_state.trial_list[st.session_state.current_trial_idx]
     
     is_correct = (current_trial['is_match'] == response_bool)
@@ -227,33 +369,90 @@ def submit_response(response_bool, rt):
     current_trial['response'] = 'Yes' if response_bool else 'No'
     current_trial['is_correct'] = is_correct
     current_trial['rt'] = rt
+    st.session_state.results.append(current_trial)
+    
+    # Server-side send times vs browser-side onsets (epoch sec), to separate RT from latency
+    current_trial['server_audio_sent'] = st.session_state.audio_sent_time
+    current_trial['server_probe_sent'] = st.session_state.start_time
+    if client_timing:
+        for name in ['client_audio_onset', 'client_probe_onset', 'client_probe_audio_onset', 'client_press']:
+            if client_timing.get(name):
+                current_trial[name] = client_timing[name] / 1000
+        if client_timing.get('client_press') and client_timing.get('client_probe_onset'):
+            current_trial['rt_client'] = (client_timing['client_press'] - client_timing['client_probe_onset']) / 1000
     
     # Autosave
+    backend = 'sqlite' if results_backend == "SQLite database" else 'csv'
     try:
         if st.session_state.exp_logic:
-            # Use stored ID/Session from the running experiment logic
-            s_id = st.session_state.exp_logic.subject_id
-            s_num = st.session_state.exp_logic.session_num
-            
             # Ensure directory exists or try to create it again just in case
             if not os.path.exists(output_dir):
                 os.makedirs(output_dir)
             
             # Save single trial
-            part_filename = os.path.join(output_dir, f"AuditoryMemoryTest_{s_id}_sess{s_num}.csv")
-            st.session_state.exp_logic.save_trial(current_trial, part_filename)
+            with AUTOSAVE_SECONDS.time(backend=backend):
+                if backend == 'sqlite':
+                    part_filename = os.path.join(output_dir, DEFAULT_DB_NAME)
+                    load_results_store(part_filename).save_trial(current_trial)
+                    st.session_state.results_db = part_filename
+                    saved = True
+                else:
+                    part_filename = st.session_state.exp_logic.autosave_filename(output_dir)
+                    saved = st.session_state.exp_logic.save_trial(current_trial, part_filename)
+                    st.session_state.autosave_path = part_filename
+            AUTOSAVE_WRITES.inc(backend=backend, outcome='ok' if saved else 'error')
                 
             # Visual confirmation
             # st.toast(f"✅ Trial {len(st.session_state.results)} Saved!", icon="💾")
             
     except PermissionError:
+        AUTOSAVE_WRITES.inc(backend=backend, outcome='error')
         st.error(f"⚠️ Could not save to {part_filename}. Please close the file if it is open!")
     except Exception as e:
+        AUTOSAVE_WRITES.inc(backend=backend, outcome='error')
         st.error(f"Autosave failed: {e}")
 
     st.session_state.last_correct = is_correct
     st.session_state.phase = 'FEEDBACK'
 
+def make_trial_key(idx):
+    return f"{st.session_state.run_id}_{st.session_state.status}_{idx}"
+
+def request_trial_render(idx, priority):
+    """Returns a Future for the trial's audio from the shared render service (reusing a prefetch)."""
+    t = st.session_state.trial_list[idx]
+    params = dict(
+        digits_list=t['digits'],
+        snr_db=t['snr'],
+        isi_ms=int(isi * 1000),
+        retention_ms=int(retention * 1000),
+        lang=lang,
+        noise_onset_ms=2000,
+        seed=trial_seed_of(t)
+    )
+    key = make_trial_key(idx)
+    pending = st.session_state.render_jobs.get(key)
+    if pending and pending[0] == params and not pending[1].cancelled():
+        if priority == URGENT:
+            load_render_service().promote(pending[1])
+        return pending[1]
+    future = load_render_service().submit(st.session_state.session_id, create_trial_audio, priority=priority, **params)
+    st.session_state.render_jobs[key] = (params, future)
+    return future
+
+def get_trial_audio(idx):
+    """The trial's audio from the render service, or rendered here if the service fails or stalls."""
+    future = request_trial_render(idx, URGENT)
+    try:
+        return future.result(timeout=RENDER_TIMEOUT_S)
+    except Exception as e:
+        # Timeout, a dead worker (BrokenProcessPool) or a render error: the participant is waiting
+        print(f"Render service failed for trial {idx + 1}: {e!r}; rendering in the script thread")
+        RENDER_FALLBACKS.inc()
+        future.cancel()
+        params, _ = st.session_state.render_jobs[make_trial_key(idx)]
+        return create_trial_audio(**params)
+
 def next_trial():
     st.session_state.current_trial_idx += 1
     if st.session_state.current_trial_idx >= len(st.session_state.trial_list):
@@ -267,76 +466,26 @@ def next_trial():
     else:
         st.session_state.phase = 'IDLE'
 
-# --- Main Layout ---
-
-st.title("🧠 AuditoryMemoryTest")
-
-if st.session_state.status == 'SETUP':
-    st.write("### Welcome to the AuditoryMemoryTest Experiment")
-    st.write("Please configure the experiment settings in the sidebar.")
-    st.info("""
-    **Experiment Procedure:**
-    1.  **Fixation**: A cross (+) appears on the screen.
-    2.  **Noise Onset**: Background noise begins (2 seconds).
-    3.  **Encoding**: You will hear a sequence of digits.
-    4.  **Retention**: A brief pause while holding the sequence in memory.
-    5.  **Retrieval**: A probe digit appears with audio. Decide if it matched one of the digits in the sequence.
-    
-    **Structure:**
-    - **Practice Block**: A few trials to get familiar with the interface (Data saved as 'Practice').
-    - **Main Experiment**: 198 trials (The actual test).
-    """)
-    st.write("Note: Ensure your audio volume is comfortable using the Calibration tool.")
-    st.write(f"Number of available digits: {len(digits_avail)}")
-    
-    if st.button("Start Experiment (Starts with Practice)", type="primary"):
-        start_experiment()
-        st.rerun()
-
-elif st.session_state.status == 'MAIN_READY':
-    st.success("✅ Practice Block Completed.")
-    st.info("You are now conducting the **Main Experiment**. Data will be recorded for analysis.")
-    st.markdown(f"### Ready for Main Experiment ({len(st.session_state.main_trials)} trials)?")
-    if st.button("🚀 Start Main Experiment", type="primary"):
-        st.session_state.status = 'MAIN'
-        st.session_state.phase = 'IDLE'
-        st.rerun()
-
-elif st.session_state.status == 'DONE':
-    st.success("🎉 Experiment Completed Successfully!")
-    
-    if st.session_state.exp_logic:
-        # Final Save
+def rerun_phase():
+    """Reruns just the trial panel, unless the block ended and the page layout changes."""
+    if st.session_state.status in ['PRACTICE', 'MAIN']:
         try:
-            csv_data = st.session_state.exp_logic.export_data(st.session_state.results)
-            
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
+            st.rerun(scope="fragment")
+        except StreamlitAPIException:
+            # Only possible during a fragment run; after a full run (e.g. a sidebar change)
+            # phases rerun the whole page until the next click inside the panel
+            pass
+    st.rerun()
 
-            # Save final local copy
-            final_filename = os.path.join(output_dir, f"AuditoryMemoryTest_{subject_id}_sess{session_num}_final.csv")
-            with open(final_filename, "w", newline='') as f:
-                f.write(csv_data)
-                
-            st.success(f"Data saved locally to: {final_filename}")
-                
-            st.download_button(
-                label="📥 Download Data as CSV",
-                data=csv_data,
-                file_name=os.path.basename(final_filename),
-                mime="text/csv"
-            )
-        except Exception as e:
-            st.error(f"Error saving data: {e}")
-            
-        # Summary
-        main_results = [r for r in st.session_state.results if r['block'] == 'Main']
-        if main_results:
-            correct_count = sum(1 for r in main_results if r.get('is_correct'))
-            total = len(main_results)
-            st.metric("Main Experiment Accuracy", f"{correct_count}/{total} ({correct_count/total*100:.1f}%)")
+@st.fragment
+def trial_panel():
+    """
+    The trial phases (IDLE -> FIXATION -> AUDITORY -> RESPONSE -> FEEDBACK).
+    Phase changes rerun only this fragment, so the sidebar, CSS and title are not
+    rebuilt and resent on every phase.
+    """
+    track_session()
 
-elif st.session_state.status in ['PRACTICE', 'MAIN']:
     # INFO BAR
     trial_count = len(st.session_state.trial_list)
     current = st.session_state.current_trial_idx + 1
@@ -357,10 +506,11 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
         
     # Get Current Trial Data
     trial = st.session_state.trial_list[st.session_state.current_trial_idx]
+    trial_key = make_trial_key(st.session_state.current_trial_idx)
     
     # CONTAINER
     placeholder = st.empty()
-    
+
     with placeholder.container():
         
         if st.session_state.phase == 'IDLE':
@@ -375,7 +525,7 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
             with c2:
                 if st.button("Start Trial", type="primary", use_container_width=True):
                     st.session_state.phase = 'FIXATION'
-                    st.rerun()
+                    rerun_phase()
 
         elif st.session_state.phase == 'FIXATION':
             st.markdown("""
@@ -385,7 +535,7 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
             """, unsafe_allow_html=True)
             time.sleep(1.0) # Baseline
             st.session_state.phase = 'AUDITORY'
-            st.rerun()
+            rerun_phase()
             
         elif st.session_state.phase == 'AUDITORY':
             # Visual: Fixation + "Listen"
@@ -397,30 +547,40 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
             """, unsafe_allow_html=True)
             
             # Generate Audio
-            # We memoize? No, params change.
-            # But creating audio takes time (~1s). 
-            # Ideally generated before? 
-            # We'll do it JIT.
+            # Full mixes are rendered by the shared render service; the next
+            # trial is prefetched at lower priority while this one plays.
             
-            b64_audio, duration_ms = create_trial_audio(
-                digits_list=trial['digits'],
-                snr_db=trial['snr'],
-                isi_ms=int(isi * 1000),
-                retention_ms=int(retention * 1000),
-                lang=lang,
-                noise_onset_ms=2000
-            )
+            stream_url = None
+            wait_started = time.perf_counter()
+            stream_server = load_stream_server() if stream_audio else None
+            if stream_server is not None:
+                # Loads the trial's clips first: the endpoint only streams items it already has
+                duration_ms = trial_duration_ms(trial['digits'], int(isi * 1000), int(retention * 1000), lang)
+                stream_url = trial_stream_url(trial['digits'], trial['snr'], int(isi * 1000), int(retention * 1000), lang,
+                                              port=stream_server.server_address[1], seed=trial_seed_of(trial))
+                b64_audio = None
+            elif fast_render:
+                bank = load_segment_bank(lang, int(isi * 1000), int(retention * 1000), tuple(st.session_state.exp_logic.available_digits))
+                b64_audio, duration_ms = bank.assemble(trial['digits'], trial['snr'], rng=trial_random(trial_seed_of(trial)))
+            else:
+                idx = st.session_state.current_trial_idx
+                b64_audio, duration_ms = get_trial_audio(idx)
+                st.session_state.render_jobs.pop(trial_key, None)
+                if idx + 1 < len(st.session_state.trial_list):
+                    request_trial_render(idx + 1, LOOKAHEAD)
+            mode = 'stream' if stream_server is not None else 'fast' if fast_render else 'full'
+            AUDIO_WAIT_SECONDS.observe(time.perf_counter() - wait_started, mode=mode)
             
-            # Autoplay
-            audio_html = f'<audio autoplay><source src="data:audio/mp3;base64,{b64_audio}" type="audio/mp3"></audio>'
-            st.markdown(audio_html, unsafe_allow_html=True)
+            # Autoplay (the browser records the actual playback onset)
+            play_trial_audio(b64_audio, trial_key, src=stream_url)
+            st.session_state.audio_sent_time = time.time()
             
             # Wait for audio to finish
             time.sleep(duration_ms / 1000 + 0.2)
             
             st.session_state.phase = 'RESPONSE'
             st.session_state.start_time = time.time()
-            st.rerun()
+            rerun_phase()
             
         elif st.session_state.phase == 'RESPONSE':
             # Display Probe
@@ -432,28 +592,19 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
             </div>
             """, unsafe_allow_html=True)
             
-            # Audio Probe (One time)
-            # Use a query param or state hack to ensure it doesn't loop?
-            # 'autoplay' plays once per DOM insertion. Rerun is a DOM insertion.
-            # But the component below is re-rendered.
-            probe_b64 = get_digit_b64(probe_digit, lang)
-            if probe_b64:
-                audio_html = f'<audio autoplay><source src="data:audio/mp3;base64,{probe_b64}" type="audio/mp3"></audio>'
-                st.markdown(audio_html, unsafe_allow_html=True)
-            
-            st.markdown("### Was this digit in the sequence?")
+            st.markdown(f"### Was this {vocab.noun} in the sequence?")
             
-            c1, c2 = st.columns(2)
-            with c1:
-                # YES
-                if st.button("YES (Match)", type="primary", use_container_width=True):
-                    submit_response(True, time.time() - st.session_state.start_time)
-                    st.rerun()
-            with c2:
-                # NO
-                if st.button("NO (Non-Match)", type="primary", use_container_width=True):
-                    submit_response(False, time.time() - st.session_state.start_time)
-                    st.rerun()
+            # Probe audio and YES/NO buttons run in the browser, which timestamps
+            # probe display, playback onsets and the button press with performance.now()
+            probe_b64 = get_digit_b64(probe_digit, lang)
+            client_response = probe_response(probe_b64, trial_key)
+            if client_response is not None:
+                submit_response(
+                    client_response['response'],
+                    time.time() - st.session_state.start_time,
+                    client_timing=client_response
+                )
+                rerun_phase()
 
         elif st.session_state.phase == 'FEEDBACK':
             is_correct = st.session_state.last_correct
@@ -468,4 +619,91 @@ elif st.session_state.status in ['PRACTICE', 'MAIN']:
             
             time.sleep(1.0) # Show feedback for 1s
             next_trial()
+            rerun_phase()
+
+# --- Main Layout ---
+
+st.title("🧠 AuditoryMemoryTest")
+
+if st.session_state.status == 'SETUP':
+    st.write("### Welcome to the AuditoryMemoryTest Experiment")
+    st.write("Please configure the experiment settings in the sidebar.")
+    st.info("""
+    **Experiment Procedure:**
+    1.  **Fixation**: A cross (+) appears on the screen.
+    2.  **Noise Onset**: Background noise begins (2 seconds).
+    3.  **Encoding**: You will hear a sequence of digits.
+    4.  **Retention**: A brief pause while holding the sequence in memory.
+    5.  **Retrieval**: A probe digit appears with audio. Decide if it matched one of the digits in the sequence.
+    
+    **Structure:**
+    - **Practice Block**: A few trials to get familiar with the interface (Data saved as 'Practice').
+    - **Main Experiment**: 198 trials (The actual test).
+    """)
+    st.write("Note: Ensure your audio volume is comfortable using the Calibration tool.")
+    st.write(f"Number of available {vocab.noun}s: {len(digits_avail)}")
+    
+    if st.button("Start Experiment (Starts with Practice)", type="primary"):
+        if start_experiment():
             st.rerun()
+
+elif st.session_state.status == 'MAIN_READY':
+    st.success("✅ Practice Block Completed.")
+    st.info("You are now conducting the **Main Experiment**. Data will be recorded for analysis.")
+    st.markdown(f"### Ready for Main Experiment ({len(st.session_state.main_trials)} trials)?")
+    if st.button("🚀 Start Main Experiment", type="primary"):
+        st.session_state.status = 'MAIN'
+        st.session_state.phase = 'IDLE'
+        st.rerun()
+
+elif st.session_state.status == 'DONE':
+    st.success("🎉 Experiment Completed Successfully!")
+    
+    if st.session_state.exp_logic:
+        # Final Save: runs once per session; later reruns (e.g. the download click) reuse it
+        if 'final_path' not in st.session_state:
+            # Nothing left to prefetch for this session
+            load_render_service().cancel_session(st.session_state.session_id)
+            st.session_state.render_jobs = {}
+            try:
+                if not os.path.exists(output_dir):
+                    os.makedirs(output_dir)
+
+                # The final copy is made from the run's autosave (or from memory if rows are missing) and renamed into place
+                s_id = st.session_state.exp_logic.subject_id
+                s_num = st.session_state.exp_logic.session_num
+                final_filename = os.path.join(output_dir, f"AuditoryMemoryTest_{s_id}_sess{s_num}_final.csv")
+                if st.session_state.get('results_db'):
+                    load_results_store(st.session_state.results_db).export_csv(final_filename, s_id, s_num,
+                                                                               run_id=st.session_state.exp_logic.run_id,
+                                                                               results=st.session_state.results)
+                else:
+                    st.session_state.exp_logic.finalize_export(st.session_state.get('autosave_path'), final_filename,
+                                                               results=st.session_state.results)
+                with open(final_filename, "rb") as f:
+                    st.session_state.final_csv = f.read()
+                st.session_state.final_path = final_filename
+            except Exception as e:
+                st.error(f"Error saving data: {e}")
+            
+            # Summary
+            main_results = [r for r in st.session_state.results if r['block'] == 'Main']
+            correct_count = sum(1 for r in main_results if r.get('is_correct'))
+            st.session_state.final_summary = (correct_count, len(main_results))
+        
+        if st.session_state.get('final_path'):
+            st.success(f"Data saved locally to: {st.session_state.final_path}")
+                
+            st.download_button(
+                label="📥 Download Data as CSV",
+                data=st.session_state.final_csv,
+                file_name=os.path.basename(st.session_state.final_path),
+                mime="text/csv"
+            )
+            
+        correct_count, total = st.session_state.final_summary
+        if total:
+            st.metric("Main Experiment Accuracy", f"{correct_count}/{total} ({correct_count/total*100:.1f}%)")
+
+elif st.session_state.status in ['PRACTICE', 'MAIN']:
+    trial_panel()
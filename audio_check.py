@@ -1,9 +1,8 @@
 import os
 import io
-import numpy as np
-import scipy.signal as signal
 from gtts import gTTS
 from pydub import AudioSegment
+from audio_manager import generate_speech_shaped_noise
 
 ASSETS_DIR = "assets"
 if not os.path.exists(ASSETS_DIR):
@@ -29,24 +28,8 @@ def get_digit_audio(digit, lang='English'):
     return AudioSegment.from_mp3(filename)
 
 def generate_noise(duration_ms):
-    # Generating 1 second of noise to test
-    sample_rate = 44100
-    samples = np.random.normal(0, 1, int(sample_rate * duration_ms / 1000))
-    
-    # Simple lowpass to make it less harsh (LTASS-ish)
-    b, a = signal.butter(1, 0.1, btype='low')
-    samples = signal.lfilter(b, a, samples)
-    
-    # Normalize
-    samples = samples / np.max(np.abs(samples)) * 0.5
-    samples = (samples * 32767).astype(np.int16)
-    
-    return AudioSegment(
-        samples.tobytes(), 
-        frame_rate=sample_rate, 
-        sample_width=2, 
-        channels=1
-    )
+    # Same LTASS noise engine the experiment uses
+    return generate_speech_shaped_noise(duration_ms, 'English')
 
 def test_pipeline():
     digit_seg = get_digit_audio(1, 'English')
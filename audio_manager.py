@@ -1,30 +1,145 @@
 import os
 import io
+import re
+import hashlib
 import random
+import subprocess
+import threading
 import numpy as np
 from pydub import AudioSegment
 from gtts import gTTS
+import scipy.fft
 import scipy.signal as signal
 import base64
+from collections import OrderedDict
+from contextlib import contextmanager
+from stimulus_bank import StimulusBank
+import metrics
+from seeding import trial_rng
 
 ASSETS_DIR = "assets"
+SAMPLE_RATE = 44100
+DIGITS = list(range(1, 10))
+
+# LTASS analysis frame (bins at SAMPLE_RATE / LTASS_NFFT Hz resolution)
+LTASS_NFFT = 2048
+# Frames quieter than this (relative to the loudest frame) are treated as silence
+LTASS_SILENCE_DB = -40.0
+
+# Clip preprocessing: silence is trimmed on CLIP_FRAME_MS frames quieter than CLIP_TRIM_DB
+# (relative to the loudest frame), keeping CLIP_PAD_MS around the speech with CLIP_FADE_MS ramps,
+# and the active-speech level (mean power of the kept frames) is set to CLIP_ACTIVE_DBFS
+CLIP_FRAME_MS = 10
+CLIP_TRIM_DB = -40.0
+CLIP_PAD_MS = 10
+CLIP_FADE_MS = 5
+CLIP_ACTIVE_DBFS = -20.0
+# Bump when the preprocessing changes, so stimulus banks built with the old one are rebuilt
+CLIP_PREPROCESS_VERSION = 1
+
+# Trial speech level: RMS of the speech stream with its ISIs included; the noise goes at this level - SNR.
+# Including the ISIs raises the clips above CLIP_ACTIVE_DBFS (by up to ~6 dB at a 2 s ISI), so the
+# target sits 6 dB below the clips' level to keep their peaks, plus noise, clear of full scale.
+TRIAL_SPEECH_DBFS = -26.0
+
+# Render buffers (see RenderContext) cover the longest trial the app offers: 2 s noise onset,
+# 6 items of up to RENDER_MAX_CLIP_MS, 2 s ISIs and 5 s retention. A longer trial grows them once.
+RENDER_MAX_CLIP_MS = 1500
+RENDER_MAX_MS = 2000 + 6 * RENDER_MAX_CLIP_MS + 5 * 2000 + 5000
+# Sums of squares are taken over blocks of this many samples (float32 dot products, added up
+# in float64), so no float64 copy of the track is made
+RMS_BLOCK = 1 << 16
+
+# Packed, memory-mapped clips and noise shared by all processes (see stimulus_bank.py)
+STIMULUS_BANK_PATH = os.path.join(ASSETS_DIR, "stimulus_bank.bin")
+
 if not os.path.exists(ASSETS_DIR):
     os.makedirs(ASSETS_DIR)
 
-def get_digit_audio(digit, lang='English'):
-    """Returns an AudioSegment for the digit."""
-    # Map full names to gTTS codes
-    lang_map = {
-        'English': 'en',
-        'Hebrew': 'iw',
-        'Arabic': 'ar',
-        'Amharic': 'am'
-    }
-    
-    lang_code = lang_map.get(lang, 'en')
-    file_prefix = lang_code
-    
-    filename = os.path.join(ASSETS_DIR, f"{file_prefix}_{digit}.mp3")
+# Map full names to gTTS codes
+LANG_MAP = {
+    'English': 'en',
+    'Hebrew': 'iw',
+    'Arabic': 'ar',
+    'Amharic': 'am'
+}
+
+# Most clips/probe payloads kept per process; large vocabularies are loaded on demand
+# and the least recently used items dropped (a clip is ~50-100 KB, a payload ~10 KB)
+CLIP_CACHE_ITEMS = 512
+PROBE_CACHE_ITEMS = 2048
+
+class _LRUCache(OrderedDict):
+    """Dict holding at most `limit` entries; reads with get() refresh an entry, inserts evict the oldest."""
+    def __init__(self, limit):
+        super().__init__()
+        self.limit = limit
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.limit:
+            self.popitem(last=False)
+
+# Ready-to-send probe payloads keyed by (lang_code, item)
+_probe_payloads = _LRUCache(PROBE_CACHE_ITEMS)
+# Decoded, preprocessed mono float32 clips keyed by (lang_code, item)
+_digit_samples = _LRUCache(CLIP_CACHE_ITEMS)
+# Sum of squares of each clip, keyed like _digit_samples
+_digit_energy = {}
+# LTASS magnitude spectra keyed by lang_code
+_ltass_cache = {}
+# Open StimulusBank, if one is in use
+_stimulus_bank = None
+
+RENDER_SECONDS = metrics.histogram('amt_render_stage_seconds', "Time spent per trial render stage (tracks, including noise; encode; base64)")
+PAYLOAD_BYTES = metrics.histogram('amt_audio_payload_bytes', "Size of base64 audio payloads rendered", buckets=metrics.SIZE_BUCKETS)
+CLIP_DECODES = metrics.counter('amt_clip_decodes_total', "Digit clips decoded from MP3 assets")
+MP3_ENCODES = metrics.counter('amt_mp3_encodes_total', "MP3 encodes of rendered audio")
+TTS_REQUESTS = metrics.counter('amt_tts_requests_total', "gTTS requests for missing assets, by outcome")
+CACHE_REQUESTS = metrics.counter('amt_cache_requests_total', "In-process cache lookups, by cache and hit/miss")
+CACHE_BYTES = metrics.gauge('amt_cache_bytes', "Memory held by the in-process caches")
+CACHE_BYTES.set_function(lambda: sum(x.nbytes for x in list(_digit_samples.values())), cache='clip')
+CACHE_BYTES.set_function(lambda: sum(len(x) for x in list(_probe_payloads.values())), cache='probe')
+
+# Item texts used as asset names as they are: one word of letters/digits/underscores, this long at most
+ASSET_NAME_MAX_CHARS = 64
+
+def _asset_name(item):
+    """
+    File-name form of an item: its text if that is a plain word (digits, letters, most words),
+    otherwise the text with every run of other characters turned into '-', cut short, plus a hash
+    of the full text, so items like 'a/b' or 'why?' stay inside ASSETS_DIR and never share a file.
+    """
+    text = str(item)
+    if len(text) <= ASSET_NAME_MAX_CHARS and re.fullmatch(r"\w+", text):
+        return text
+    slug = re.sub(r"\W+", "-", text).strip("-")[:32]
+    digest = hashlib.sha1(text.encode("utf-8")).hexdigest()[:12]
+    return f"{slug}-{digest}" if slug else digest
+
+def _asset_path(digit, lang):
+    return os.path.join(ASSETS_DIR, f"{LANG_MAP.get(lang, 'en')}_{_asset_name(digit)}.mp3")
+
+def has_digit_clip(digit, lang='English'):
+    """True if the item's clip is available without generating it (decoded, in the stimulus bank, or on disk)."""
+    key = (LANG_MAP.get(lang, 'en'), digit)
+    if key in _digit_samples:
+        return True
+    if _stimulus_bank is not None and _stimulus_bank.clip(*key) is not None:
+        return True
+    return os.path.exists(_asset_path(digit, lang))
+
+def get_digit_path(digit, lang='English'):
+    """Returns the asset path for the digit (or any vocabulary item), generating it with gTTS if missing."""
+    lang_code = LANG_MAP.get(lang, 'en')
+    filename = _asset_path(digit, lang)
     
     if not os.path.exists(filename):
         text = str(digit)
@@ -32,18 +147,197 @@ def get_digit_audio(digit, lang='English'):
         try:
             tts = gTTS(text=text, lang=lang_code, slow=False)
             tts.save(filename)
+            TTS_REQUESTS.inc(lang=lang_code, outcome='ok')
         except Exception as e:
             print(f"Error generating {text}: {e}")
+            TTS_REQUESTS.inc(lang=lang_code, outcome='error')
+            # Don't leave a partial file behind to be taken for the asset next time
+            if os.path.exists(filename):
+                os.remove(filename)
             return None
             
+    return filename
+
+def get_digit_audio(digit, lang='English'):
+    """Returns an AudioSegment for the digit."""
+    filename = get_digit_path(digit, lang)
+    if filename is None:
+        return None
     return AudioSegment.from_mp3(filename)
 
-def generate_speech_shaped_noise(duration_ms):
-    """Generates noise with a spectrum similar to speech (LTASS approximation)."""
-    sample_rate = 44100
+def use_stimulus_bank(path=STIMULUS_BANK_PATH):
+    """
+    Serves clips and noise from a packed stimulus bank instead of decoding assets.
+    Returns the bank, or None if it is missing or older than the assets.
+    """
+    global _stimulus_bank
+    if not os.path.exists(path):
+        return None
+    bank_mtime = os.path.getmtime(path)
+    for name in os.listdir(ASSETS_DIR):
+        if name.endswith(".mp3") and os.path.getmtime(os.path.join(ASSETS_DIR, name)) > bank_mtime:
+            print(f"Stimulus bank {path} is older than {name}; rebuild it with stimulus_bank.py")
+            return None
+    bank = StimulusBank(path)
+    if bank.sample_rate != SAMPLE_RATE:
+        print(f"Stimulus bank {path} is not at {SAMPLE_RATE} Hz; ignoring it")
+        return None
+    if bank.index.get('clip_preprocess') != CLIP_PREPROCESS_VERSION:
+        print(f"Stimulus bank {path} was built with other clip preprocessing; rebuild it with stimulus_bank.py")
+        return None
+    _stimulus_bank = bank
+    _digit_samples.clear()
+    _digit_energy.clear()
+    return bank
+
+def preprocess_clip(samples):
+    """
+    Trims leading/trailing silence and sets the active-speech level of a clip
+    (see the CLIP_* constants). Returns a new float32 array.
+    """
+    frame = int(SAMPLE_RATE * CLIP_FRAME_MS / 1000)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return samples.astype(np.float32)
+    power = np.mean(samples[:n_frames * frame].reshape(n_frames, frame).astype(np.float64) ** 2, axis=1)
+    active = power > power.max() * 10 ** (CLIP_TRIM_DB / 10)
+    if not active.any():
+        return samples.astype(np.float32)
+    
+    first, last = np.flatnonzero(active)[[0, -1]]
+    pad = int(SAMPLE_RATE * CLIP_PAD_MS / 1000)
+    start = max(first * frame - pad, 0)
+    end = min((last + 1) * frame + pad, len(samples))
+    clip = samples[start:end].astype(np.float32)
+    
+    fade = min(int(SAMPLE_RATE * CLIP_FADE_MS / 1000), len(clip) // 2)
+    if fade:
+        ramp = (0.5 - 0.5 * np.cos(np.linspace(0, np.pi, fade))).astype(np.float32)
+        clip[:fade] *= ramp
+        clip[-fade:] *= ramp[::-1]
+    
+    clip *= np.float32(10 ** (CLIP_ACTIVE_DBFS / 20) / np.sqrt(power[active].mean()))
+    return clip
+
+def get_digit_samples(digit, lang='English'):
+    """
+    Returns the digit clip as mono float32 samples at SAMPLE_RATE, silence-trimmed and
+    level-normalized (see preprocess_clip). Decoded once per process, or read from the stimulus bank.
+    """
+    key = (LANG_MAP.get(lang, 'en'), digit)
+    samples = _digit_samples.get(key)
+    CACHE_REQUESTS.inc(cache='clip', result='miss' if samples is None else 'hit')
+    if samples is None and _stimulus_bank is not None:
+        samples = _stimulus_bank.clip(*key)
+        if samples is not None:
+            _digit_samples[key] = samples
+    if samples is None:
+        seg = get_digit_audio(digit, lang)
+        if seg is None:
+            return None
+        CLIP_DECODES.inc(lang=key[0])
+        seg = seg.set_frame_rate(SAMPLE_RATE).set_channels(1).set_sample_width(2)
+        samples = preprocess_clip(np.array(seg.get_array_of_samples(), dtype=np.float32) / 32768.0)
+        _digit_samples[key] = samples
+    return samples
+
+def get_digit_energy(digit, lang='English'):
+    """Sum of squares of the digit clip (cached), so speech levels are computed without a pass over the samples."""
+    key = (LANG_MAP.get(lang, 'en'), digit)
+    energy = _digit_energy.get(key)
+    if energy is None:
+        samples = get_digit_samples(digit, lang)
+        energy = 0.0 if samples is None else float(np.sum(np.square(samples, dtype=np.float64)))
+        _digit_energy[key] = energy
+    return energy
+
+def compute_ltass(lang='English', digits=DIGITS):
+    """
+    Long-term average speech spectrum of a language's digit clips.
+    Computed once per language and cached.
+    
+    Returns: float32 magnitude spectrum (LTASS_NFFT // 2 + 1 bins), unit RMS.
+    """
+    lang_code = LANG_MAP.get(lang, 'en')
+    if lang_code in _ltass_cache:
+        return _ltass_cache[lang_code]
+    
+    hop = LTASS_NFFT // 2
+    window = np.hanning(LTASS_NFFT).astype(np.float32)
+    frames = []
+    for d in digits:
+        x = get_digit_samples(d, lang)
+        if x is None or len(x) < LTASS_NFFT:
+            continue
+        # All frames of the clip at once: (n_frames, LTASS_NFFT)
+        idx = np.arange(0, len(x) - LTASS_NFFT + 1, hop)[:, None] + np.arange(LTASS_NFFT)
+        frames.append(x[idx])
+    
+    if not frames:
+        _ltass_cache[lang_code] = None
+        return None
+    
+    frames = np.concatenate(frames)
+    # Average only active speech frames so gTTS padding does not flatten the spectrum
+    energy = np.sum(frames ** 2, axis=1)
+    active = energy > energy.max() * 10 ** (LTASS_SILENCE_DB / 10)
+    power = np.mean(np.abs(np.fft.rfft(frames[active] * window, axis=1)) ** 2, axis=0)
+    
+    magnitude = np.sqrt(power).astype(np.float32)
+    magnitude /= np.sqrt(np.mean(magnitude ** 2))
+    _ltass_cache[lang_code] = magnitude
+    return magnitude
+
+def generate_ltass_noise(duration_ms, lang='English', rng=None):
+    """
+    Synthesizes noise with the language's LTASS (the RenderContext synthesis, so every
+    noise in the app comes from one routine). rng is a np.random.Generator (default: fresh OS entropy).
+    Returns float32 samples at SAMPLE_RATE with an RMS of 0.1 (-20 dBFS), or None if no LTASS.
+    """
+    num_samples = int(SAMPLE_RATE * duration_ms / 1000)
+    shaped = RenderContext(duration_ms, rng).ltass_noise(num_samples, lang)
+    if shaped is None:
+        return None
+    rms = _rms(shaped)
+    if rms > 0:
+        shaped *= np.float32(0.1 / rms)
+    return shaped
+
+def _samples_to_segment(samples):
+    """Converts float samples in [-1, 1] to a 16-bit mono AudioSegment."""
+    pcm = (np.clip(samples, -1.0, 32767 / 32768) * 32768).astype(np.int16)
+    return AudioSegment(
+        pcm.tobytes(),
+        frame_rate=SAMPLE_RATE,
+        sample_width=2,
+        channels=1
+    )
+
+def generate_noise_samples(duration_ms, lang=None, rng=None):
+    """
+    Generates noise with a spectrum similar to speech, as float32 samples at SAMPLE_RATE.
+    With a language, the noise follows that language's LTASS (see generate_ltass_noise);
+    otherwise (or if its clips are unavailable) a 1 kHz lowpass approximation is used.
+    rng is a np.random.Generator (default: fresh OS entropy; see seeding.trial_rng).
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    num_samples = int(SAMPLE_RATE * duration_ms / 1000)
+    if lang is not None and _stimulus_bank is not None:
+        bed = _stimulus_bank.noise(LANG_MAP.get(lang, 'en'))
+        if bed is not None and len(bed) > 0:
+            # Random stretch of the pre-rendered noise bed (wrapping), at 0.1 RMS like the LTASS engine
+            idx = (rng.integers(len(bed)) + np.arange(num_samples)) % len(bed)
+            return bed[idx] * np.float32(0.1)
+    
+    if lang is not None:
+        ltass_noise = generate_ltass_noise(duration_ms, lang, rng)
+        if ltass_noise is not None:
+            return ltass_noise
+    
+    sample_rate = SAMPLE_RATE
     # Generate white noise
     num_samples = int(sample_rate * duration_ms / 1000)
-    white_noise = np.random.normal(0, 1, num_samples)
+    white_noise = rng.normal(0, 1, num_samples)
     
     # 2nd order Butterworth lowpass at 1kHz to approximate speech shape roll-off
     b, a = signal.butter(2, 1000 / (sample_rate / 2), btype='low')
@@ -51,114 +345,311 @@ def generate_speech_shaped_noise(duration_ms):
     
     # Normalize to avoid clipping and generally fit 16-bit
     # Target RMS? We will adjust later. Just normalize peak to 0.5
-    max_val = np.max(np.abs(shaped_noise))
+    max_val = np.max(np.abs(shaped_noise)) if num_samples else 0
     if max_val > 0:
         shaped_noise = shaped_noise / max_val * 0.5
         
-    shaped_noise = (shaped_noise * 32767).astype(np.int16)
-    
-    audio = AudioSegment(
-        shaped_noise.tobytes(), 
-        frame_rate=sample_rate,
-        sample_width=2, 
-        channels=1
+    return shaped_noise.astype(np.float32)
+
+def generate_speech_shaped_noise(duration_ms, lang=None, rng=None):
+    """Generates speech-shaped noise (see generate_noise_samples) as an AudioSegment."""
+    return _samples_to_segment(generate_noise_samples(duration_ms, lang, rng))
+
+def _rms(x):
+    if not len(x):
+        return 0.0
+    energy = sum(float(np.dot(x[i:i + RMS_BLOCK], x[i:i + RMS_BLOCK])) for i in range(0, len(x), RMS_BLOCK))
+    return float(np.sqrt(energy / len(x)))
+
+def _irfft_into(spectrum, out):
+    # numpy >= 2 writes the transform into out; older versions allocate it
+    try:
+        return np.fft.irfft(spectrum, n=len(out), out=out)
+    except TypeError:
+        out[:] = np.fft.irfft(spectrum, n=len(out))
+        return out
+
+class RenderContext:
+    """
+    Reusable work buffers for rendering trials in place: float32 speech, noise and mix tracks,
+    the 16-bit PCM sent to the encoder, and the LTASS noise spectrum, all sized for
+    RENDER_MAX_MS. With a context, render_trial_tracks and mix_pcm write into these buffers
+    instead of allocating per trial; the arrays they return are views, valid until the next
+    render with the same context. Not thread-safe: one render at a time (see render_context).
+    """
+    def __init__(self, max_ms=RENDER_MAX_MS, rng=None):
+        self.rng = rng if rng is not None else np.random.default_rng()
+        # (lang_code, fft_len) -> LTASS gain on that FFT grid
+        self._gains = {}
+        self._allocate(int(SAMPLE_RATE * max_ms / 1000))
+
+    @staticmethod
+    def _fft_len(num_samples):
+        # Noise is synthesized at whole-second lengths, so only a few gain grids are ever needed
+        seconds = -(-num_samples // SAMPLE_RATE)
+        return scipy.fft.next_fast_len(max(seconds, 1) * SAMPLE_RATE, real=True)
+
+    def _allocate(self, num_samples):
+        self.max_samples = num_samples
+        self.speech = np.zeros(num_samples, dtype=np.float32)
+        self.noise = np.zeros(num_samples, dtype=np.float32)
+        self.mix = np.zeros(num_samples, dtype=np.float32)
+        self.pcm = np.zeros(num_samples, dtype=np.int16)
+        fft_len = self._fft_len(num_samples)
+        self.spectrum = np.zeros(fft_len // 2 + 1, dtype=np.complex64)
+        self.shaped = np.zeros(fft_len, dtype=np.float32)
+
+    def reserve(self, num_samples):
+        """Grows the buffers if a trial is longer than they are."""
+        if num_samples > self.max_samples:
+            self._allocate(num_samples)
+
+    def _ltass_gain(self, lang, fft_len):
+        key = (LANG_MAP.get(lang, 'en'), fft_len)
+        gain = self._gains.get(key)
+        if gain is None:
+            magnitude = compute_ltass(lang)
+            if magnitude is None:
+                return None
+            ltass_freqs = np.fft.rfftfreq(LTASS_NFFT, 1 / SAMPLE_RATE)
+            freqs = np.fft.rfftfreq(fft_len, 1 / SAMPLE_RATE)
+            gain = self._gains[key] = np.interp(freqs, ltass_freqs, magnitude).astype(np.float32)
+        return gain
+
+    def noise_samples(self, num_samples, lang, rng=None):
+        """
+        Speech-shaped noise as in generate_noise_samples (stimulus bank bed, else LTASS synthesis),
+        written into the noise buffer. Its level is arbitrary; render_trial_tracks sets it.
+        rng is a np.random.Generator (default: the context's own).
+        """
+        rng = rng if rng is not None else self.rng
+        self.reserve(num_samples)
+        out = self.noise[:num_samples]
+        if _stimulus_bank is not None:
+            bed = _stimulus_bank.noise(LANG_MAP.get(lang, 'en'))
+            if bed is not None and len(bed) > 0:
+                # Random stretch of the pre-rendered noise bed, wrapping around its end
+                pos = int(rng.integers(len(bed)))
+                done = 0
+                while done < num_samples:
+                    n = min(num_samples - done, len(bed) - pos)
+                    out[done:done + n] = bed[pos:pos + n]
+                    done += n
+                    pos = 0
+                return out
+
+        if self.ltass_noise(num_samples, lang, rng) is None:
+            # No clips for an LTASS: lowpass fallback (allocates, but only runs without assets)
+            out[:] = generate_noise_samples(num_samples * 1000 / SAMPLE_RATE + 1, rng=rng)[:num_samples]
+        return out
+
+    def ltass_noise(self, num_samples, lang, rng=None):
+        """LTASS-shaped noise of arbitrary level in the noise buffer (None if the language has no LTASS)."""
+        rng = rng if rng is not None else self.rng
+        self.reserve(num_samples)
+        out = self.noise[:num_samples]
+        fft_len = self._fft_len(num_samples)
+        gain = self._ltass_gain(lang, fft_len)
+        if gain is None:
+            return None
+
+        # The rFFT of white noise is drawn directly: independent normal real/imaginary parts per bin,
+        # with real-valued DC and Nyquist bins (sqrt(2) keeps their variance), then shaped and inverted
+        spectrum = self.spectrum[:fft_len // 2 + 1]
+        rng.standard_normal(dtype=np.float32, out=spectrum.view(np.float32))
+        spectrum[0] = spectrum[0].real * np.float32(np.sqrt(2))
+        if fft_len % 2 == 0:
+            spectrum[-1] = spectrum[-1].real * np.float32(np.sqrt(2))
+        # Real gain on both halves of each bin (no complex temporary)
+        spectrum.view(np.float32).reshape(-1, 2)[:] *= gain[:, None]
+        shaped = _irfft_into(spectrum, self.shaped[:fft_len])
+        out[:] = shaped[:num_samples]
+        return out
+
+    def mix_pcm(self, speech, noise):
+        """speech + noise, clipped to 16-bit PCM (a view into the pcm buffer)."""
+        n = len(speech)
+        mix = self.mix[:n]
+        np.add(speech, noise, out=mix)
+        np.clip(mix, -1.0, 32767 / 32768, out=mix)
+        mix *= np.float32(32768)
+        pcm = self.pcm[:n]
+        np.copyto(pcm, mix, casting='unsafe')
+        return pcm
+
+# RenderContexts kept by the process for reuse (renders beyond this many at once get a context of their own)
+RENDER_POOL_SIZE = 4
+_render_pool = []
+_render_pool_lock = threading.Lock()
+
+@contextmanager
+def render_context():
+    """
+    Checks a RenderContext out of the process's pool for the with-block, and returns it afterwards.
+    Contexts are pooled rather than kept per thread because Streamlit runs each rerun on a new thread.
+    """
+    with _render_pool_lock:
+        ctx = _render_pool.pop() if _render_pool else None
+    if ctx is None:
+        ctx = RenderContext()
+    try:
+        yield ctx
+    finally:
+        with _render_pool_lock:
+            if len(_render_pool) < RENDER_POOL_SIZE:
+                _render_pool.append(ctx)
+
+def _encode_mp3(pcm):
+    """Encodes 16-bit mono PCM at SAMPLE_RATE to MP3 with one ffmpeg call, piped (no WAV temp file)."""
+    proc = subprocess.run(
+        [AudioSegment.converter, "-loglevel", "error", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1",
+         "-i", "pipe:0", "-f", "mp3", "pipe:1"],
+        input=memoryview(pcm).cast('B'), capture_output=True, check=True
     )
-    return audio
+    return proc.stdout
 
-def create_trial_audio(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000):
+def render_trial_tracks(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000, ctx=None, rng=None):
     """
-    Creates phase audio:
+    Renders the trial timeline as separate, level-adjusted float32 tracks of equal length:
     timeline: [Noise (2s)] [Digit1][ISI][Digit2][ISI]... [Retention(Noise)]
-    Note: The noise is continuous throughout.
+    The mix is speech + noise. Speech is set to TRIAL_SPEECH_DBFS RMS over the whole speech
+    stream (ISIs included) and the noise to TRIAL_SPEECH_DBFS - snr_db.
+    With a RenderContext, the tracks are rendered in place into its buffers; without one,
+    into a new context's (same synthesis either way, so a seeded trial renders the same).
+    The noise is drawn from rng (a np.random.Generator, e.g. seeding.trial_rng of the trial).
     
-    Returns: base64 encoded audio string (mp3).
+    Returns: (speech, noise, speech_start, speech_end) with sample offsets of the speech stream.
     """
     
     # 1. Load Speech Segments
     speech_segments = []
     for d in digits_list:
-        seg = get_digit_audio(d, lang)
+        seg = get_digit_samples(d, lang)
         if seg is None:
             # Fallback
-            seg = AudioSegment.silent(duration=500)
+            seg = np.zeros(int(SAMPLE_RATE * 0.5), dtype=np.float32)
         speech_segments.append(seg)
     
     # Create speech track
     # Speech starts at noise_onset_ms
     # Sequence: D1 + Silence(ISI) + D2 + Silence(ISI) ... 
-    # Use overlay on a silent track? Or concatenation?
-    # Concat is easier for the speech stream.
-    
-    speech_stream = AudioSegment.empty()
-    silence_isi = AudioSegment.silent(duration=isi_ms)
+    onset = int(SAMPLE_RATE * noise_onset_ms / 1000)
+    isi = int(SAMPLE_RATE * isi_ms / 1000)
+    retention = int(SAMPLE_RATE * retention_ms / 1000)
+    speech_len = sum(len(seg) for seg in speech_segments) + isi * max(len(speech_segments) - 1, 0)
+    total = onset + speech_len + retention
     
-    for i, seg in enumerate(speech_segments):
-        speech_stream += seg
-        if i < len(speech_segments) - 1:
-            speech_stream += silence_isi
+    if ctx is None:
+        ctx = RenderContext(total * 1000 / SAMPLE_RATE)
+    ctx.reserve(total)
+    speech = ctx.speech[:total]
+    speech.fill(0)
+    pos = onset
+    for seg in speech_segments:
+        speech[pos:pos + len(seg)] = seg
+        pos += len(seg) + isi
             
     # 2. Generate Background Noise
-    # Total duration = noise_onset_ms + speech_stream_duration + retention_ms
-    total_duration = noise_onset_ms + len(speech_stream) + retention_ms
-    
-    noise_track = generate_speech_shaped_noise(total_duration)
+    with RENDER_SECONDS.time(stage='noise'):
+        noise = ctx.noise_samples(total, lang, rng)
     
     # 3. Adjust Levels for SNR
     # SNR = 20 * log10(RMS_signal / RMS_noise)
-    # We fix Speech at -20 dBFS usually.
-    target_speech_dbfs = -20.0
-    
-    if len(speech_stream) > 0:
-        speech_stream = speech_stream.apply_gain(target_speech_dbfs - speech_stream.dBFS)
+    target_speech_dbfs = TRIAL_SPEECH_DBFS
+    speech_energy = sum(get_digit_energy(d, lang) for d in digits_list)
+    speech_rms = np.sqrt(speech_energy / speech_len) if speech_len else 0.0
     
-        # RMS_noise = RMS_signal / 10^(SNR/20)
+    if speech_rms > 0:
+        speech *= np.float32(10 ** (target_speech_dbfs / 20) / speech_rms)
         # dB_noise = dB_signal - SNR
         target_noise_dbfs = target_speech_dbfs - snr_db
-        
-        # Adjust noise gain
-        noise_track = noise_track.apply_gain(target_noise_dbfs - noise_track.dBFS)
-        
-        # 4. Overlay
-        # Overlay speech onto noise at silence offset
-        full_audio = noise_track.overlay(speech_stream, position=noise_onset_ms)
     else:
-        # Just noise (e.g. calibration or emtpy trial?)
-        # Set noise to target level based on 0dB assumption if speech were there?
-        # User said "Calibration: Play continuous LTASS noise at 0dB SNR level". 
-        # This implies Noise Level calculated as if SNR was 0.
-        # So Target Noise = Target Speech (-20) - 0 = -20 dBFS.
-        target_noise_dbfs = -20.0
-        noise_track = noise_track.apply_gain(target_noise_dbfs - noise_track.dBFS)
-        full_audio = noise_track
-        
-    # Export
-    buf = io.BytesIO()
-    full_audio.export(buf, format="mp3")
-    b64_data = base64.b64encode(buf.getvalue()).decode()
+        # Just noise (e.g. calibration or empty trial):
+        # noise level as if SNR was 0
+        target_noise_dbfs = target_speech_dbfs
+    
+    noise_rms = _rms(noise)
+    if noise_rms > 0:
+        noise *= np.float32(10 ** (target_noise_dbfs / 20) / noise_rms)
+    
+    return speech, noise, onset, onset + speech_len
+
+def create_trial_audio(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000, seed=None):
+    """
+    Creates phase audio:
+    timeline: [Noise (2s)] [Digit1][ISI][Digit2][ISI]... [Retention(Noise)]
+    Note: The noise is continuous throughout.
+    
+    The mix is rendered in a pooled RenderContext's buffers (see render_context); only the MP3 and
+    its base64 are new.
+    With a seed (seeding.trial_seed), the noise comes from the trial's own stream, so the
+    same trial renders bit-identically in any process, in any order.
+    
+    Returns: base64 encoded audio string (mp3) and its duration in ms.
+    """
+    with render_context() as ctx:
+        with RENDER_SECONDS.time(stage='tracks'):
+            speech, noise, _, _ = render_trial_tracks(digits_list, snr_db, isi_ms, retention_ms, lang, noise_onset_ms,
+                                                      ctx=ctx, rng=trial_rng(seed))
+
+        # 4. Overlay
+        pcm = ctx.mix_pcm(speech, noise)
+        total_duration = int(round(len(speech) * 1000 / SAMPLE_RATE))
+
+        # Export (the PCM is a view into the context, so it is encoded before the context goes back)
+        with RENDER_SECONDS.time(stage='encode'):
+            mp3 = _encode_mp3(pcm)
+    MP3_ENCODES.inc()
+    with RENDER_SECONDS.time(stage='base64'):
+        b64_data = base64.b64encode(mp3).decode()
+    PAYLOAD_BYTES.observe(len(b64_data), kind='trial')
     
     return b64_data, total_duration
 
 def get_digit_b64(digit, lang='English'):
-    """Returns base64 audio for a single digit."""
-    seg = get_digit_audio(digit, lang)
-    if seg:
-        buf = io.BytesIO()
-        seg.export(buf, format="mp3")
-        return base64.b64encode(buf.getvalue()).decode()
-    return ""
-
-def get_calibration_audio(snr_db=0, duration_sec=10):
+    """
+    Returns base64 audio for a single digit: the preprocessed clip (trimmed, at CLIP_ACTIVE_DBFS,
+    as used in the trials), not the raw asset. Encoded once per process and cached.
+    """
+    key = (LANG_MAP.get(lang, 'en'), digit)
+    payload = _probe_payloads.get(key)
+    CACHE_REQUESTS.inc(cache='probe', result='miss' if payload is None else 'hit')
+    if payload is None:
+        samples = get_digit_samples(digit, lang)
+        if samples is None:
+            return ""
+        pcm = (np.clip(samples, -1.0, 32767 / 32768) * 32768).astype(np.int16)
+        payload = base64.b64encode(_encode_mp3(pcm)).decode()
+        MP3_ENCODES.inc()
+        PAYLOAD_BYTES.observe(len(payload), kind='probe')
+        _probe_payloads[key] = payload
+    return payload
+
+def build_probe_table(digits, langs=None):
+    """
+    Precomputes probe payloads for every (language, digit) so RESPONSE is a dict lookup.
+    Meant for small vocabularies: beyond PROBE_CACHE_ITEMS payloads the oldest are dropped again.
+    """
+    if langs is None:
+        langs = list(LANG_MAP)
+    for lang in langs:
+        for d in digits:
+            get_digit_b64(d, lang)
+    return _probe_payloads
+
+def get_calibration_audio(snr_db=0, duration_sec=10, lang='English'):
     """Returns base64 audio for calibration (continuous noise at specified SNR level)."""
-    # Note: SNR level implies the noise level relative to a theoretical speech level of -20 dBFS.
-    # If SNR is 0dB, Noise is -20 dBFS.
-    # If SNR is 10dB, Noise is -30 dBFS.
+    # Note: SNR level implies the noise level relative to the trials' speech level (TRIAL_SPEECH_DBFS).
+    # If SNR is 0dB, Noise is at TRIAL_SPEECH_DBFS.
+    # If SNR is 10dB, Noise is 10 dB below it.
     
-    noise = generate_speech_shaped_noise(duration_sec * 1000)
-    target_speech_dbfs = -20.0
+    noise = generate_speech_shaped_noise(duration_sec * 1000, lang)
+    target_speech_dbfs = TRIAL_SPEECH_DBFS
     target_noise_dbfs = target_speech_dbfs - snr_db
     
     noise = noise.apply_gain(target_noise_dbfs - noise.dBFS)
     
     buf = io.BytesIO()
     noise.export(buf, format="mp3")
+    MP3_ENCODES.inc()
     return base64.b64encode(buf.getvalue()).decode()
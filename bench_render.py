@@ -0,0 +1,82 @@
+"""
+Measures memory allocated per trial render, with and without a RenderContext.
+
+Renders the same trials through render_trial_tracks + the 16-bit mix, once allocating
+fresh arrays per trial (as before RenderContext) and once in a context's reusable
+buffers, and reports the tracemalloc peak per trial above the steady state (median and
+max). With --encode, it also measures the whole create_trial_audio (MP3 and base64 included).
+
+    python bench_render.py [--trials N] [--encode]
+"""
+import argparse
+import random
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import audio_manager as am
+
+
+def _allocating(t, isi_ms, retention_ms, lang):
+    speech, noise, _, _ = am.render_trial_tracks(t[0], t[1], isi_ms, retention_ms, lang)
+    return (np.clip(speech + noise, -1.0, 32767 / 32768) * 32768).astype(np.int16).tobytes()
+
+
+def _in_context(ctx):
+    def render(t, isi_ms, retention_ms, lang):
+        speech, noise, _, _ = am.render_trial_tracks(t[0], t[1], isi_ms, retention_ms, lang, ctx=ctx)
+        return ctx.mix_pcm(speech, noise)
+    return render
+
+
+def _full(t, isi_ms, retention_ms, lang):
+    return am.create_trial_audio(t[0], t[1], isi_ms, retention_ms, lang)
+
+
+def measure(render, trials, isi_ms, retention_ms, lang):
+    """
+    (median and max peak MB per trial above the starting point, ms per trial); the first trial
+    warms the caches, but a trial length seen for the first time still builds its LTASS gain grid.
+    """
+    render(trials[0], isi_ms, retention_ms, lang)
+    peaks, times = [], []
+    tracemalloc.start()
+    try:
+        for t in trials:
+            base = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+            t0 = time.perf_counter()
+            render(t, isi_ms, retention_ms, lang)
+            times.append(time.perf_counter() - t0)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    finally:
+        tracemalloc.stop()
+    return np.median(peaks) / 1e6, np.max(peaks) / 1e6, 1000 * np.mean(times)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Per-trial render allocations with and without a RenderContext.")
+    parser.add_argument('--trials', type=int, default=20)
+    parser.add_argument('--lang', default='English')
+    parser.add_argument('--isi', type=int, default=800)
+    parser.add_argument('--retention', type=int, default=2000)
+    parser.add_argument('--encode', action='store_true', help="Also measure create_trial_audio (MP3 + base64)")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(0)
+    trials = [(rng.sample(am.DIGITS, rng.choice([2, 4, 6])), rng.choice([10, 5, 0])) for _ in range(args.trials)]
+    cases = [("allocating", _allocating), ("RenderContext", _in_context(am.RenderContext()))]
+    if args.encode:
+        cases.append(("create_trial_audio", _full))
+
+    print(f"{args.trials} trials, {args.lang}, ISI {args.isi} ms, retention {args.retention} ms")
+    for name, render in cases:
+        median_mb, max_mb, ms = measure(render, trials, args.isi, args.retention, args.lang)
+        print(f"  {name:20s} peak {median_mb:7.3f} MB/trial (max {max_mb:6.3f}) | {ms:6.1f} ms/trial")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Measures server time and bytes sent per phase transition of the trial panel.
+
+Drives app.py headlessly with streamlit's AppTest, with the phase sleeps
+disabled and fast rendering on, and reports per-trial and per-script-run
+(full or fragment) cost for IDLE -> FIXATION -> AUDITORY -> RESPONSE.
+
+    python bench_reruns.py [n_trials]
+"""
+import sys
+import time
+
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+from streamlit.runtime.scriptrunner_utils.script_requests import RerunData
+from streamlit.testing.v1 import AppTest, local_script_runner
+
+_stats = {'bytes': 0, 'runs': 0}
+_enqueue = ForwardMsgQueue.enqueue
+_clear = ForwardMsgQueue.clear
+
+
+def _count_enqueue(self, msg):
+    _stats['bytes'] += msg.ByteSize()
+    return _enqueue(self, msg)
+
+
+def _count_clear(self, *args, **kwargs):
+    # Called once at the start of every script run (full or fragment)
+    _stats['runs'] += 1
+    return _clear(self, *args, **kwargs)
+
+
+def _fragment_rerun_data(fragment_id):
+    # AppTest always reruns the whole script; a browser click inside a fragment reruns only the fragment
+    def make(**kwargs):
+        return RerunData(fragment_id_queue=[fragment_id], is_fragment_scoped_rerun=True, **kwargs)
+    return make
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def main(n_trials=5):
+    ForwardMsgQueue.enqueue = _count_enqueue
+    ForwardMsgQueue.clear = _count_clear
+    # The phase timers are not part of the server cost
+    time.sleep = lambda s: None
+
+    at = AppTest.from_file("app.py", default_timeout=300)
+    at.run()
+    next(c for c in at.checkbox if c.label.startswith("Fast render")).check().run()
+    _button(at, "Start Experiment (Starts with Practice)").click().run()
+
+    results = []
+    for i in range(n_trials + 1):
+        _stats.update(bytes=0, runs=0)
+        t0 = time.perf_counter()
+        fragment_ids = list(at._fragment_storage._fragments)
+        if fragment_ids:
+            local_script_runner.RerunData = _fragment_rerun_data(fragment_ids[0])
+        try:
+            _button(at, "Start Trial").click().run()
+        finally:
+            local_script_runner.RerunData = RerunData
+        elapsed = time.perf_counter() - t0
+        if at.session_state.phase != 'RESPONSE':
+            raise RuntimeError(f"Expected RESPONSE, got {at.session_state.phase}")
+        if i > 0:
+            # The first trial warms caches (segment bank, component registry)
+            results.append((elapsed, _stats['bytes'], _stats['runs']))
+        # Move on to the next trial as a response would
+        at.session_state.phase = 'IDLE'
+        at.session_state.current_trial_idx = (at.session_state.current_trial_idx + 1) % len(at.session_state.trial_list)
+        at.run()
+
+    per_trial_ms = 1000 * sum(r[0] for r in results) / len(results)
+    per_trial_bytes = sum(r[1] for r in results) / len(results)
+    runs = sum(r[2] for r in results) / len(results)
+    print(f"{len(results)} trials, {runs:.1f} script runs per trial (IDLE -> RESPONSE)")
+    print(f"  server time: {per_trial_ms:8.1f} ms/trial | {per_trial_ms / runs:6.1f} ms/run")
+    print(f"  bytes sent:  {per_trial_bytes:8.0f} B/trial  | {per_trial_bytes / runs:6.0f} B/run")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
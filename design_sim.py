@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from listener import SimulatedListener
+
+# Effects tested on every simulated experiment (per-subject contrasts, one-sample t-test across subjects)
+EFFECTS = ['load', 'snr', 'interaction']
+
+
+class ListenerPopulation:
+    """
+    Simulated subjects around a typical listener (a SimulatedListener, for its accuracy model).
+    Each subject gets their own intercept, SNR slope and load slope, drawn from normals with
+    the listener's values as means and the given SDs.
+    """
+    def __init__(self, listener=None, intercept_sd=0.5, snr_slope_sd=0.03, load_slope_sd=0.1):
+        listener = listener or SimulatedListener()
+        # Only the accuracy parameters (the listener's rng does not travel to worker processes)
+        self.intercept = listener.intercept
+        self.snr_slope = listener.snr_slope
+        self.load_slope = listener.load_slope
+        self.guess = listener.guess
+        self.lapse = listener.lapse
+        self.intercept_sd = intercept_sd
+        self.snr_slope_sd = snr_slope_sd
+        self.load_slope_sd = load_slope_sd
+
+    def p_correct(self, loads, snrs, n_sims, n_subjects, rng):
+        """P(correct), shape (n_sims, n_subjects, len(loads), len(snrs))."""
+        shape = (n_sims, n_subjects, 1, 1)
+        intercept = rng.normal(self.intercept, self.intercept_sd, shape)
+        snr_slope = rng.normal(self.snr_slope, self.snr_slope_sd, shape)
+        load_slope = rng.normal(self.load_slope, self.load_slope_sd, shape)
+        x = intercept + snr_slope * np.asarray(snrs, dtype=float)[None, :] - load_slope * np.asarray(loads, dtype=float)[:, None]
+        return self.guess + (1 - self.guess - self.lapse) * stats.logistic.cdf(x)
+
+
+def _contrasts(loads, snrs):
+    """Weights over the load x SNR cells: linear load slope, linear SNR slope and their interaction (per unit)."""
+    lc = np.asarray(loads, dtype=float) - np.mean(loads)
+    sc = np.asarray(snrs, dtype=float) - np.mean(snrs)
+    load_w = np.outer(lc / np.sum(lc ** 2), np.full(len(snrs), 1 / len(snrs))) if np.any(lc) else None
+    snr_w = np.outer(np.full(len(loads), 1 / len(loads)), sc / np.sum(sc ** 2)) if np.any(sc) else None
+    inter_w = np.outer(lc / np.sum(lc ** 2), sc / np.sum(sc ** 2)) if np.any(lc) and np.any(sc) else None
+    return {'load': load_w, 'snr': snr_w, 'interaction': inter_w}
+
+
+def simulate_design(loads, snrs, main_reps, n_subjects, n_sims, population=None, alpha=0.05, seed=None):
+    """
+    Simulates n_sims experiments of n_subjects, each running the main block of
+    generate_trials(loads, snrs, main_reps): main_reps trials per load x SNR cell.
+    Trials within a cell are independent given the subject, so each cell's correct count is
+    one binomial draw and the whole batch is a handful of array operations.
+
+    Returns: dict per effect with 'power' (share of experiments with p < alpha), 'mean'
+    (average estimate: accuracy change per load item / per dB / per item x dB) and 'se'
+    (SD of the estimate across experiments, i.e. its precision).
+    """
+    population = population or ListenerPopulation()
+    rng = np.random.default_rng(seed)
+    p = population.p_correct(loads, snrs, n_sims, n_subjects, rng)
+    accuracy = rng.binomial(main_reps, p) / main_reps
+
+    results = {}
+    for name, weights in _contrasts(loads, snrs).items():
+        if weights is None:
+            results[name] = {'power': np.nan, 'mean': np.nan, 'se': np.nan}
+            continue
+        # Per-subject effect estimates, (n_sims, n_subjects)
+        est = np.einsum('enab,ab->en', accuracy, weights)
+        mean = est.mean(axis=1)
+        sd = est.std(axis=1, ddof=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = mean / (sd / np.sqrt(n_subjects))
+        p_values = 2 * stats.t.sf(np.abs(t), n_subjects - 1)
+        results[name] = {
+            'power': float(np.mean(np.nan_to_num(p_values, nan=1.0) < alpha)),
+            'mean': float(mean.mean()),
+            'se': float(mean.std(ddof=1)),
+        }
+    return results
+
+
+def _run_chunk(args):
+    design, n_subjects, n_sims, population, alpha, seed = args
+    return simulate_design(design['loads'], design['snrs'], design['main_reps'], n_subjects, n_sims, population, alpha, seed)
+
+
+def _merge(chunks, sizes):
+    """Combines per-chunk results (weighted by simulations per chunk)."""
+    total = sum(sizes)
+    merged = {}
+    for name in EFFECTS:
+        w = np.array(sizes) / total
+        means = np.array([c[name]['mean'] for c in chunks])
+        mean = float(np.sum(w * means))
+        # Pooled SD of the estimate: within-chunk variance plus between-chunk spread
+        var = np.sum(w * (np.array([c[name]['se'] for c in chunks]) ** 2 + (means - mean) ** 2))
+        merged[name] = {
+            'power': float(np.sum(w * np.array([c[name]['power'] for c in chunks]))),
+            'mean': mean,
+            'se': float(np.sqrt(var)),
+        }
+    return merged
+
+
+def sweep(designs, subjects=(20,), n_sims=2000, population=None, alpha=0.05, seed=0, workers=None, chunk_sims=500):
+    """
+    Power and precision for every design x subject count.
+    designs: dicts with 'loads', 'snrs' and 'main_reps' (as passed to generate_trials).
+    Simulations are split in chunks of chunk_sims, spread across processes, each chunk with
+    its own independent random stream (SeedSequence.spawn), so results do not depend on workers.
+
+    Returns: DataFrame with one row per design x subject count.
+    """
+    population = population or ListenerPopulation()
+    cases = list(itertools.product(designs, subjects))
+    sizes = [min(chunk_sims, n_sims - i) for i in range(0, n_sims, chunk_sims)]
+    seeds = np.random.SeedSequence(seed).spawn(len(cases) * len(sizes))
+    jobs = [(design, n, size, population, alpha, seeds[c * len(sizes) + k])
+            for c, (design, n) in enumerate(cases) for k, size in enumerate(sizes)]
+
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        chunks = list(pool.map(_run_chunk, jobs))
+
+    rows = []
+    for c, (design, n) in enumerate(cases):
+        merged = _merge(chunks[c * len(sizes):(c + 1) * len(sizes)], sizes)
+        row = {
+            'loads': '/'.join(str(l) for l in design['loads']),
+            'snrs': '/'.join(str(s) for s in design['snrs']),
+            'main_reps': design['main_reps'],
+            'trials': len(design['loads']) * len(design['snrs']) * design['main_reps'],
+            'subjects': n,
+        }
+        for name in EFFECTS:
+            row[f'{name}_power'] = merged[name]['power']
+            row[f'{name}_mean'] = merged[name]['mean']
+            row[f'{name}_se'] = merged[name]['se']
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def _int_list(text):
+    return [int(x) for x in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Monte Carlo power/precision of load x SNR effects for experiment designs.")
+    parser.add_argument('--loads', type=_int_list, nargs='+', default=[[2, 4, 6]], help="e.g. 2,4,6 2,6")
+    parser.add_argument('--snrs', type=_int_list, nargs='+', default=[[10, 5, 0]], help="e.g. 10,5,0 10,0")
+    parser.add_argument('--reps', type=int, nargs='+', default=[6, 10, 14, 18, 22], help="Main repetitions per condition")
+    parser.add_argument('--subjects', type=int, nargs='+', default=[12, 20, 30])
+    parser.add_argument('--sims', type=int, default=2000, help="Simulated experiments per design")
+    parser.add_argument('--alpha', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=None, help="Processes (default: one per CPU)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', default=None, help="Also write the table to this CSV")
+    args = parser.parse_args(argv)
+
+    designs = [{'loads': l, 'snrs': s, 'main_reps': r} for l in args.loads for s in args.snrs for r in args.reps]
+    t0 = time.perf_counter()
+    df = sweep(designs, args.subjects, args.sims, alpha=args.alpha, seed=args.seed, workers=args.workers)
+    elapsed = time.perf_counter() - t0
+
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.3f}'.format):
+        print(df.to_string(index=False))
+    print(f"{len(designs)} designs x {len(args.subjects)} subject counts x {args.sims} experiments in {elapsed:.1f}s")
+    if args.out:
+        df.to_csv(args.out, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,35 @@
-import random
+import uuid
+
 import pandas as pd
-from datetime import datetime
+import metrics
+from trial_table import TrialTable, COLUMNS
+from schedule import balanced_order, build_block
+from vocabulary import DIGITS
+from seeding import block_random, new_root_seed
+
+CSV_WRITE_SECONDS = metrics.histogram('amt_csv_write_seconds', "Time to write results CSV, by operation (trial append, final export)")
+CSV_WRITE_FAILURES = metrics.counter('amt_csv_write_failures_total', "Results CSV writes that failed, by operation")
+EXPORTS_FROM_MEMORY = metrics.counter('amt_exports_from_memory_total', "Final exports written from the in-memory results because the autosave was missing or incomplete")
 
 class ExperimentLogic:
-    def __init__(self, subject_id, session_num, available_digits, age):
+    def __init__(self, subject_id, session_num, available_digits, age, vocabulary=DIGITS, seed=None):
         self.subject_id = subject_id
         self.session_num = session_num
-        self.available_digits = [int(d) for d in available_digits] # Ensure ints
+        # Tells this run apart from other runs of the same subject and session (autosave file name, run_id column)
+        self.run_id = uuid.uuid4().hex[:12]
+        # Root of the session's random streams (block generation, per-trial noise), saved with every trial
+        self.seed = new_root_seed() if seed is None else int(seed)
+        # Stimulus items to draw from (digits by default; see vocabulary.py)
+        self.vocabulary = vocabulary
+        self.available_digits = [vocabulary.coerce(d) for d in available_digits]
         self.age = age
-        self.trials = []
-        self.practice_trials = []
-        self.main_trials = []
+        # Integer items (digits) are stored as-is; other vocabularies by index
+        self._table_items = None if all(isinstance(i, int) for i in vocabulary.items) else vocabulary.items
+        self.practice_trials = self._new_table()
+        self.main_trials = self._new_table()
+
+    def _new_table(self):
+        return TrialTable(self.subject_id, self.session_num, items=self._table_items, seed=self.seed, run_id=self.run_id)
         
     def generate_trials(self, loads=[2, 4, 6], snrs=[10, 5, 0], main_reps=22, num_practice=3, randomize=False):
         # Validate inputs
@@ -36,84 +55,94 @@ class ExperimentLogic:
                 sorted_conditions.append((load, snr))
         
         # Practice Block (Cycle through sorted conditions)
-        self.practice_trials = []
+        self.practice_trials = self._new_table()
         if sorted_conditions:
             import itertools
             practice_cycle = itertools.cycle(sorted_conditions)
-            for i in range(num_practice):
-                load, snr = next(practice_cycle)
-                self.practice_trials.append(self._create_trial(i+1, "Practice", load, snr))
+            practice_conds = [next(practice_cycle) for _ in range(num_practice)]
+            self._fill_block(self.practice_trials, "Practice", practice_conds, self._block_rng("Practice"))
             
         # Main Block
-        self.main_trials = []
+        self.main_trials = self._new_table()
         all_main_conds = []
+        main_rng = self._block_rng("Main")
         
         if randomize:
-            # Full mix
-            all_main_conds = sorted_conditions * main_reps
-            random.shuffle(all_main_conds)
+            # Full mix, never the same condition twice in a row
+            all_main_conds = balanced_order(sorted_conditions, main_reps, main_rng)
         else:
             # Blocked (Sequential by difficulty)
             for cond in sorted_conditions:
                 all_main_conds.extend([cond] * main_reps)
         
-        for i, (load, snr) in enumerate(all_main_conds):
-            self.main_trials.append(self._create_trial(i+1, "Main", load, snr))
+        self._fill_block(self.main_trials, "Main", all_main_conds, main_rng)
             
         return self.practice_trials, self.main_trials
 
-    def _create_trial(self, num, block, load, snr):
-        # Sequence
-        seq = random.sample(self.available_digits, load)
-        
-        # Probe
-        # 50% Match
-        is_match = random.choice([True, False])
-        
-        if is_match:
-            probe = random.choice(seq)
-        else:
-            remaining = [d for d in self.available_digits if d not in seq]
-            if remaining:
-                probe = random.choice(remaining)
-            else:
-                # Should not happen if load < available
-                probe = random.choice([d for d in self.available_digits if d not in seq]) if [d for d in self.available_digits if d not in seq] else seq[0] # Fallback
-                is_match = True # Force match if no lures possible
-                
-        return {
-            'timestamp': str(datetime.now()),
-            'subject_id': self.subject_id,
-            'session': self.session_num,
-            'block': block,
-            'trial_num': num,
-            'load': load,
-            'snr': snr,
-            'digits': seq,
-            'probe': probe,
-            'is_match': is_match,
-            'response': None,
-            'is_correct': None,
-            'rt': None
-        }
+    def _block_rng(self, block):
+        # Each block has its own stream, so a block is the same whatever was generated before it
+        return block_random(self.seed, self.session_num, block)
+
+    def _fill_block(self, table, block, conditions, rng):
+        # Sequences, probes and match/lure are balanced per load x SNR cell (see schedule.build_block)
+        for i, (load, snr, seq, probe, is_match) in enumerate(build_block(conditions, self.available_digits, rng)):
+            table.append(block, i+1, load, snr, seq, probe, is_match)
 
     def export_data(self, all_trials_data):
-        """Converts list of trial dicts to CSV."""
+        """Converts a TrialTable (or a list of trial dicts/records) to CSV."""
+        if isinstance(all_trials_data, TrialTable):
+            return all_trials_data.to_frame().to_csv(index=False)
+        
         if not all_trials_data:
             # Return headers only
-            cols = ['timestamp', 'subject_id', 'session', 'block', 'trial_num', 'load', 'snr', 'digits', 'probe', 'is_match', 'response', 'is_correct', 'rt']
-            return pd.DataFrame(columns=cols).to_csv(index=False)
+            return pd.DataFrame(columns=COLUMNS).to_csv(index=False)
             
-        df = pd.DataFrame(all_trials_data)
+        df = pd.DataFrame([dict(t) for t in all_trials_data])
         # Flatten digits list
         if 'digits' in df.columns:
             df['digits'] = df['digits'].apply(lambda x: str(x))
             
         return df.to_csv(index=False)
 
+    def autosave_filename(self, out_dir):
+        """Per-run autosave CSV, so restarting a subject's session never appends to an earlier run."""
+        import os
+        return os.path.join(out_dir, f"AuditoryMemoryTest_{self.subject_id}_sess{self.session_num}_run{self.run_id}.csv")
+
+    def finalize_export(self, autosave_filename, final_filename, results=None):
+        """
+        Publishes the autosave file as the final CSV (copied, then renamed into place atomically).
+        With `results` (the run's answered trials), the autosave is only used if it holds exactly
+        that many rows; otherwise (a failed autosave) the final CSV is written from `results`.
+        """
+        import os
+        import shutil
+        tmp_filename = final_filename + ".tmp"
+        try:
+            with CSV_WRITE_SECONDS.time(operation='export'):
+                has_autosave = bool(autosave_filename) and os.path.exists(autosave_filename)
+                if has_autosave and results is not None:
+                    saved_rows = len(pd.read_csv(autosave_filename))
+                    if saved_rows != len(results):
+                        print(f"Autosave {autosave_filename} has {saved_rows} rows, expected {len(results)}: exporting from memory")
+                        has_autosave = False
+                if has_autosave:
+                    shutil.copyfile(autosave_filename, tmp_filename)
+                else:
+                    # No autosave (or an incomplete one): written from the results, headers only if there are none
+                    if results:
+                        EXPORTS_FROM_MEMORY.inc()
+                    with open(tmp_filename, "w", newline='') as f:
+                        f.write(self.export_data(results or []))
+                os.replace(tmp_filename, final_filename)
+        except Exception:
+            CSV_WRITE_FAILURES.inc(operation='export')
+            raise
+        return final_filename
+
     def save_trial(self, trial_data, filename):
-        """Appends a single trial to a CSV file."""
-        df = pd.DataFrame([trial_data])
+        """Appends a single trial to a CSV file; returns False if it could not be written."""
+        df = pd.DataFrame([dict(trial_data)])
         
         # Flatten digits list
         if 'digits' in df.columns:
@@ -124,7 +153,11 @@ class ExperimentLogic:
         header = not os.path.exists(filename)
         
         try:
-            df.to_csv(filename, mode='a', header=header, index=False)
+            with CSV_WRITE_SECONDS.time(operation='trial'):
+                df.to_csv(filename, mode='a', header=header, index=False)
         except Exception as e:
+            CSV_WRITE_FAILURES.inc(operation='trial')
             print(f"Error saving trial: {e}")
+            return False
+        return True
 
@@ -0,0 +1,36 @@
+import math
+import random
+
+
+class SimulatedListener:
+    """
+    Answers probes with accuracy and RT that depend on load and SNR.
+
+    P(correct) = guess + (1 - guess - lapse) * logistic(intercept + snr_slope * snr - load_slope * load)
+    RT (s)     = rt_base + rt_per_item * load + rt_per_db * (rt_ref_snr - snr), times lognormal noise
+    """
+    def __init__(self, intercept=1.5, snr_slope=0.15, load_slope=0.4, guess=0.5, lapse=0.02,
+                 rt_base=0.6, rt_per_item=0.05, rt_per_db=0.01, rt_ref_snr=10, rt_sigma=0.25, rng=random):
+        self.intercept = intercept
+        self.snr_slope = snr_slope
+        self.load_slope = load_slope
+        self.guess = guess
+        self.lapse = lapse
+        self.rt_base = rt_base
+        self.rt_per_item = rt_per_item
+        self.rt_per_db = rt_per_db
+        self.rt_ref_snr = rt_ref_snr
+        self.rt_sigma = rt_sigma
+        self.rng = rng
+
+    def p_correct(self, load, snr):
+        x = self.intercept + self.snr_slope * snr - self.load_slope * load
+        return self.guess + (1 - self.guess - self.lapse) / (1 + math.exp(-x))
+
+    def respond(self, trial):
+        """Returns (response_bool, rt) for a trial record."""
+        correct = self.rng.random() < self.p_correct(trial['load'], trial['snr'])
+        response = trial['is_match'] if correct else not trial['is_match']
+        mean_rt = self.rt_base + self.rt_per_item * trial['load'] + self.rt_per_db * (self.rt_ref_snr - trial['snr'])
+        rt = mean_rt * self.rng.lognormvariate(-self.rt_sigma ** 2 / 2, self.rt_sigma)
+        return bool(response), rt
@@ -0,0 +1,249 @@
+import bisect
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = os.environ.get("AMT_METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("AMT_METRICS_PORT", "9108"))
+# Ports tried after METRICS_PORT while it is taken (e.g. by another server process), before any free port
+METRICS_PORT_FALLBACKS = 10
+
+# Latency buckets (seconds), from a cached lookup to a full render + encode
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Payload buckets (bytes)
+SIZE_BUCKETS = (1e4, 3e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def samples(self):
+        """[(suffix, label_key, extra_labels, value)] for the exposition text."""
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def value(self, **labels):
+        """Current value for the labels (0 if never set); meant for tests."""
+        with self._lock:
+            return self._values.get(_label_key(labels), 0)
+
+
+class Counter(_Metric):
+    """Monotonic count, one series per label set."""
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down; set directly or read from a function at scrape time."""
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        super().__init__(name, help)
+        self._functions = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, fn, **labels):
+        """Reads the value from fn() on every scrape."""
+        with self._lock:
+            self._functions[_label_key(labels)] = fn
+
+    def _read_functions(self):
+        with self._lock:
+            functions = list(self._functions.items())
+        values = {}
+        for key, fn in functions:
+            try:
+                values[key] = fn()
+            except Exception:
+                values[key] = math.nan
+        return values
+
+    def samples(self):
+        values = self._read_functions()
+        with self._lock:
+            values.update((k, v) for k, v in self._values.items() if k not in values)
+        return [("", key, (), value) for key, value in values.items()]
+
+    def value(self, **labels):
+        key = _label_key(labels)
+        values = self._read_functions()
+        if key in values:
+            return values[key]
+        return super().value(**labels)
+
+
+class Histogram(_Metric):
+    """Distribution over fixed buckets (cumulative in the exposition), plus sum and count."""
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            series['counts'][bisect.bisect_left(self.buckets, value)] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the duration of the with-block (in seconds)."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def samples(self):
+        out = []
+        with self._lock:
+            for key, series in self._values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), series['counts']):
+                    cumulative += count
+                    out.append(("_bucket", key, (("le", _format_value(bound)),), cumulative))
+                out.append(("_sum", key, (), series['sum']))
+                out.append(("_count", key, (), series['count']))
+        return out
+
+    def value(self, **labels):
+        """(count, sum) for the labels; meant for tests."""
+        with self._lock:
+            series = self._values.get(_label_key(labels))
+            return (series['count'], series['sum']) if series else (0, 0.0)
+
+
+class Registry:
+    """Named metrics of this process. Asking for an existing name returns the same metric."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, help, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind}")
+            return metric
+
+    def counter(self, name, help):
+        return self._get(Counter, name, help)
+
+    def gauge(self, name, help):
+        return self._get(Gauge, name, help)
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help, buckets=buckets)
+
+    def get(self, name):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, key, extra, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(key, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """GET /metrics"""
+    registry = REGISTRY
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT, fallbacks=METRICS_PORT_FALLBACKS):
+    """
+    Serves /metrics on a daemon thread (local only by default) and returns the server.
+    If the port is taken, the next `fallbacks` ports are tried, then a free one picked by the OS;
+    server.server_address holds the port it got. Port 0 goes straight to a free port.
+    """
+    ports = [port + i for i in range(fallbacks + 1)] + [0] if port else [0]
+    for i, candidate in enumerate(ports):
+        try:
+            server = ThreadingHTTPServer((host, candidate), MetricsHandler)
+            break
+        except OSError:
+            if i == len(ports) - 1:
+                raise
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,234 @@
+import collections
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import types
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Job priorities: a participant waiting right now goes ahead of prefetching
+URGENT = 0
+LOOKAHEAD = 1
+
+# Wait times kept for the metrics
+WAIT_WINDOW = 1000
+
+
+_main_lock = threading.Lock()
+
+
+@contextmanager
+def _without_main_script():
+    """
+    Hides the __main__ module while worker processes are launched. Spawned workers re-import
+    the parent's __main__ by its __file__, and under Streamlit that is the app script, which
+    would then run in every worker (metrics port, probe table, a RenderService of its own).
+    """
+    with _main_lock:
+        main = sys.modules['__main__']
+        sys.modules['__main__'] = types.ModuleType('__main__')
+        try:
+            yield
+        finally:
+            sys.modules['__main__'] = main
+
+
+def _init_worker():
+    # Workers read clips/noise from the shared stimulus bank when one is built
+    from audio_manager import use_stimulus_bank
+    use_stimulus_bank()
+
+
+class _Job:
+    __slots__ = ('session_id', 'priority', 'fn', 'args', 'kwargs', 'future', 'submitted_at')
+
+    def __init__(self, session_id, priority, fn, args, kwargs):
+        self.session_id = session_id
+        self.priority = priority
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.submitted_at = time.monotonic()
+
+
+class RenderService:
+    """
+    Server-wide render executor shared by all sessions (own it with st.cache_resource).
+
+    Jobs run in a process pool, so rendering does not compete with the script threads for the GIL.
+    Jobs are only handed to the pool when a worker is free, so ordering stays under our control:
+    URGENT before LOOKAHEAD, and round-robin across sessions within a priority,
+    so one participant's prefetching cannot starve another's current trial.
+    If a worker dies (e.g. killed for memory), its jobs fail with BrokenProcessPool and the
+    pool is replaced, so later jobs still run.
+    """
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or max(1, (os.cpu_count() or 2) - 1)
+        self._pool = self._new_pool()
+        self._restarts = 0
+        self._free = threading.Semaphore(self.max_workers)
+        self._cond = threading.Condition()
+        # priority -> OrderedDict(session_id -> deque of jobs); dict order is the round-robin order
+        self._queues = {URGENT: collections.OrderedDict(), LOOKAHEAD: collections.OrderedDict()}
+        self._jobs = {}
+        self._running = 0
+        self._completed = 0
+        self._cancelled = 0
+        self._waits = collections.deque(maxlen=WAIT_WINDOW)
+        self._closed = False
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _new_pool(self):
+        # Spawned, not forked: a fork of the threaded server could inherit a lock held by another thread
+        return ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker)
+
+    def _replace_pool(self, broken):
+        """Swaps in a new pool if `broken` is still the current one (jobs failing together replace it once)."""
+        with self._cond:
+            if self._pool is not broken or self._closed:
+                return
+            self._pool = self._new_pool()
+            self._restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, session_id, fn, *args, priority=URGENT, **kwargs):
+        """
+        Queues fn(*args, **kwargs) and returns a Future for its result. fn must be picklable and
+        defined in an importable module, not in the main script (workers never import it).
+        """
+        job = _Job(session_id, priority, fn, args, kwargs)
+        with self._cond:
+            self._queues[priority].setdefault(session_id, collections.deque()).append(job)
+            self._jobs[job.future] = job
+            self._cond.notify()
+        return job.future
+
+    def promote(self, future):
+        """Moves a still-queued LOOKAHEAD job to URGENT (the participant is now waiting on it)."""
+        with self._cond:
+            job = self._jobs.get(future)
+            if job is None or job.priority == URGENT:
+                return
+            queue = self._queues[LOOKAHEAD].get(job.session_id)
+            if queue is None or job not in queue:
+                return
+            queue.remove(job)
+            if not queue:
+                del self._queues[LOOKAHEAD][job.session_id]
+            job.priority = URGENT
+            self._queues[URGENT].setdefault(job.session_id, collections.deque()).appendleft(job)
+            self._cond.notify()
+
+    def cancel_session(self, session_id):
+        """Cancels a session's queued jobs (jobs already running in a worker finish normally)."""
+        with self._cond:
+            for queues in self._queues.values():
+                for job in queues.pop(session_id, ()):
+                    job.future.cancel()
+                    self._jobs.pop(job.future, None)
+                    self._cancelled += 1
+
+    def _next_job(self):
+        for priority in (URGENT, LOOKAHEAD):
+            queues = self._queues[priority]
+            if queues:
+                session_id, queue = next(iter(queues.items()))
+                job = queue.popleft()
+                # Rotate the session to the back, so the next pick serves someone else
+                del queues[session_id]
+                if queue:
+                    queues[session_id] = queue
+                return job
+        return None
+
+    def _dispatch(self):
+        while True:
+            self._free.acquire()
+            with self._cond:
+                job = self._next_job()
+                while job is None and not self._closed:
+                    self._cond.wait()
+                    job = self._next_job()
+                if job is None:
+                    return
+                if not job.future.set_running_or_notify_cancel():
+                    self._jobs.pop(job.future, None)
+                    self._cancelled += 1
+                    self._free.release()
+                    continue
+                self._running += 1
+                self._waits.append(time.monotonic() - job.submitted_at)
+                pool = self._pool
+            try:
+                # Workers are launched on submit
+                with _without_main_script():
+                    pool_future = pool.submit(job.fn, *job.args, **job.kwargs)
+            except BrokenProcessPool:
+                # A worker died since the last job: replace the pool and try once more
+                self._replace_pool(pool)
+                try:
+                    pool = self._pool
+                    with _without_main_script():
+                        pool_future = pool.submit(job.fn, *job.args, **job.kwargs)
+                except Exception as e:
+                    self._fail(job, e)
+                    continue
+            except Exception as e:
+                # e.g. the pool was shut down; the job must not stay RUNNING forever
+                self._fail(job, e)
+                continue
+            pool_future.add_done_callback(lambda f, job=job, pool=pool: self._finish(job, f, pool))
+
+    def _fail(self, job, error):
+        with self._cond:
+            self._running -= 1
+            self._completed += 1
+            self._jobs.pop(job.future, None)
+        self._free.release()
+        job.future.set_exception(error)
+
+    def _finish(self, job, pool_future, pool):
+        with self._cond:
+            self._running -= 1
+            self._completed += 1
+            self._jobs.pop(job.future, None)
+        self._free.release()
+        if pool_future.cancelled():
+            # Still queued in a pool that was shut down when it was replaced
+            job.future.set_exception(BrokenProcessPool("Render pool was replaced"))
+            return
+        error = pool_future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._replace_pool(pool)
+        if job.future.cancelled():
+            return
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(pool_future.result())
+
+    def metrics(self):
+        """Queue depth per priority, running jobs, pool restarts, and queue wait times (ms) over the last jobs."""
+        with self._cond:
+            waits = sorted(self._waits)
+            return {
+                'queue_depth_urgent': sum(len(q) for q in self._queues[URGENT].values()),
+                'queue_depth_lookahead': sum(len(q) for q in self._queues[LOOKAHEAD].values()),
+                'running': self._running,
+                'completed': self._completed,
+                'cancelled': self._cancelled,
+                'pool_restarts': self._restarts,
+                'wait_ms_mean': 1000 * sum(waits) / len(waits) if waits else 0.0,
+                'wait_ms_p95': 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+            }
+
+    def shutdown(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+
+import pandas as pd
+
+import metrics
+from trial_table import COLUMNS
+
+DEFAULT_DB_NAME = "AuditoryMemoryTest.sqlite"
+# How long a writer waits for another station's transaction before giving up (ms)
+BUSY_TIMEOUT_MS = 10000
+
+_SQL_TYPES = {
+    'timestamp': 'TEXT', 'subject_id': 'TEXT', 'session': 'TEXT', 'block': 'TEXT', 'digits': 'TEXT',
+    'response': 'TEXT', 'trial_num': 'INTEGER', 'load': 'INTEGER', 'snr': 'INTEGER', 'probe': 'INTEGER',
+    'is_match': 'INTEGER', 'is_correct': 'INTEGER', 'seed': 'INTEGER', 'run_id': 'TEXT',
+}
+# Stored as 0/1/NULL, exported as booleans like the CSV autosave
+_BOOL_COLUMNS = ['is_match', 'is_correct']
+
+EXPORTS_FROM_MEMORY = metrics.counter('amt_exports_from_memory_total', "Final exports written from the in-memory results because the autosave was missing or incomplete")
+
+
+class ResultsStore:
+    """
+    Trial results in one SQLite database, shared by every station writing to the directory.
+
+    The database runs in WAL mode, so writers never block readers and each commit is a
+    short append to the log; synchronous=FULL makes every committed trial durable.
+    Trials saved at the same time by this server's sessions are committed together
+    (see save_trial), so a busy server makes one transaction per batch, not per trial.
+    SQLite locking needs a local disk: keep the database out of network drives and
+    synced (e.g. Google Drive) folders.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        # Group commit: trials waiting for the next batch, and whether a batch is being written
+        self._group = threading.Condition()
+        self._pending = []
+        self._committing = False
+        # One connection per store, shared by the session threads under _lock
+        self._conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT_MS / 1000, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        columns = ", ".join(f'"{c}" {_SQL_TYPES.get(c, "REAL")}' for c in COLUMNS)
+        with self._lock:
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS trials (id INTEGER PRIMARY KEY, {columns})")
+            # Databases created before a column was added get it (NULL for their existing rows)
+            existing = {row[1] for row in self._conn.execute("PRAGMA table_info(trials)")}
+            for c in COLUMNS:
+                if c not in existing:
+                    self._conn.execute(f'ALTER TABLE trials ADD COLUMN "{c}" {_SQL_TYPES.get(c, "REAL")}')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS trials_subject ON trials (subject_id, session, block, trial_num)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS trials_condition ON trials ("load", snr)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS trials_run ON trials (run_id)')
+
+    @staticmethod
+    def _row(trial):
+        trial = dict(trial)
+        row = []
+        for c in COLUMNS:
+            value = trial.get(c)
+            if c == 'digits' and value is not None:
+                value = str(list(value))
+            elif c in ('subject_id', 'session', 'timestamp') and value is not None:
+                value = str(value)
+            elif isinstance(value, bool):
+                value = int(value)
+            row.append(value)
+        return row
+
+    def _insert(self, rows):
+        placeholders = ", ".join("?" * len(COLUMNS))
+        names = ", ".join(f'"{c}"' for c in COLUMNS)
+        with self._lock:
+            # BEGIN IMMEDIATE takes the write lock up front, so a busy database waits here, not mid-transaction
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany(f"INSERT INTO trials ({names}) VALUES ({placeholders})", rows)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def save_trial(self, trial_data):
+        """
+        Inserts one trial; it is on disk when this returns. If another thread is already writing,
+        the trial waits and goes into the next save_trials batch, with every trial queued meanwhile.
+        """
+        request = {'trial': dict(trial_data), 'done': False, 'error': None}
+        with self._group:
+            self._pending.append(request)
+            while not request['done'] and self._committing:
+                self._group.wait()
+            if not request['done']:
+                # Nobody is writing: this thread writes everything queued so far
+                batch, self._pending = self._pending, []
+                self._committing = True
+        if not request['done']:
+            error = None
+            try:
+                self.save_trials([r['trial'] for r in batch])
+            except BaseException as e:
+                error = e
+            with self._group:
+                for r in batch:
+                    r['done'] = True
+                    r['error'] = error
+                self._committing = False
+                self._group.notify_all()
+        if request['error'] is not None:
+            raise request['error']
+
+    def save_trials(self, trials):
+        """Inserts many trials in one transaction (all or none)."""
+        self._insert([self._row(t) for t in trials])
+
+    def query(self, subject_id=None, session=None, run_id=None):
+        """Trials as a DataFrame in CSV column order, optionally for one subject/session/run."""
+        where, params = [], []
+        if subject_id is not None:
+            where.append("subject_id = ?")
+            params.append(str(subject_id))
+        if session is not None:
+            where.append("session = ?")
+            params.append(str(session))
+        if run_id is not None:
+            where.append("run_id = ?")
+            params.append(str(run_id))
+        names = ", ".join(f'"{c}"' for c in COLUMNS)
+        sql = f"SELECT {names} FROM trials" + (" WHERE " + " AND ".join(where) if where else "") + " ORDER BY id"
+        with self._lock:
+            df = pd.read_sql_query(sql, self._conn, params=params)
+        return self._exported(df)
+
+    @staticmethod
+    def _exported(df):
+        for c in _BOOL_COLUMNS:
+            df[c] = df[c].astype('boolean')
+        return df
+
+    def export_csv(self, filename, subject_id=None, session=None, run_id=None, results=None):
+        """
+        Writes the (subject/session/run's) trials to a CSV, renamed into place atomically.
+        With `results` (the run's answered trials), the stored rows are only exported if there
+        are exactly that many; otherwise (a failed save) the CSV is written from `results`,
+        formatted as the stored rows would have been.
+        """
+        df = self.query(subject_id, session, run_id)
+        if results is not None and len(df) != len(results):
+            print(f"{self.path} has {len(df)} rows for this run, expected {len(results)}: exporting from memory")
+            EXPORTS_FROM_MEMORY.inc()
+            df = self._exported(pd.DataFrame([self._row(t) for t in results], columns=COLUMNS))
+        tmp_filename = filename + ".tmp"
+        df.to_csv(tmp_filename, index=False)
+        os.replace(tmp_filename, filename)
+        return filename
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,153 @@
+import random
+
+
+class _Deck:
+    """
+    Deals indices 0..n-1 from back-to-back random permutations, so every index is used
+    equally often (±1) and any draw of up to n indices has no repeats.
+    Permutations are shuffled lazily (one Fisher-Yates step per dealt index), so a block
+    costs the same for 9 items as for thousands. Exclusions are int bitmasks (bit i = index i).
+    """
+    # Random picks tried before scanning the remainder for an allowed index
+    TRIES = 8
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.rng = rng
+        # order[:pos] has been dealt from the current permutation; order[pos:] has not
+        self.order = list(range(n))
+        self.pos = 0
+
+    def _take(self, j):
+        order, pos = self.order, self.pos
+        order[pos], order[j] = order[j], order[pos]
+        self.pos += 1
+        return order[pos]
+
+    def _deal(self, excluded):
+        """Deals a random undealt index not in `excluded`, or returns None if there is none."""
+        for _ in range(self.TRIES):
+            j = self.rng.randrange(self.pos, self.n)
+            if not (excluded >> self.order[j]) & 1:
+                return self._take(j)
+        allowed = [j for j in range(self.pos, self.n) if not (excluded >> self.order[j]) & 1]
+        if not allowed:
+            return None
+        return self._take(self.rng.choice(allowed))
+
+    def draw(self, k):
+        """Draws k distinct indices."""
+        out = []
+        mask = 0
+        for _ in range(k):
+            if self.pos == self.n:
+                self.pos = 0
+            # Within a permutation picks are distinct anyway; across the boundary the mask keeps them so
+            i = self._deal(mask)
+            mask |= 1 << i
+            out.append(i)
+        return out
+
+    def draw_excluding(self, excluded):
+        """Draws one index whose bit is not set in `excluded` (which must leave at least one)."""
+        if self.pos < self.n:
+            i = self._deal(excluded)
+            if i is not None:
+                return i
+        # Nothing allowed is left in this permutation: start the next one
+        self.pos = 0
+        return self._deal(excluded)
+
+
+def balanced_order(conditions, reps, rng=random):
+    """
+    Random order with every condition exactly `reps` times and no condition
+    twice in a row (when there are at least two conditions).
+    Built as `reps` shuffled rounds; a round starting with the previous
+    condition has its first element swapped with another one.
+    """
+    conditions = list(conditions)
+    order = []
+    for _ in range(reps):
+        round_ = list(conditions)
+        rng.shuffle(round_)
+        if order and len(round_) > 1 and round_[0] == order[-1]:
+            k = rng.randrange(1, len(round_))
+            round_[0], round_[k] = round_[k], round_[0]
+        order.extend(round_)
+    return order
+
+
+def _match_flags(count, extra_match, rng):
+    """Exactly half matches (odd counts get the extra as given), with runs of at most 2."""
+    flags = []
+    if count % 2:
+        flags.append(extra_match)
+    for _ in range(count // 2):
+        pair = [True, False]
+        rng.shuffle(pair)
+        flags.extend(pair)
+    return flags
+
+
+def _cycled_positions(count, load, rng):
+    """Probe serial positions 0..load-1, each used equally often (±1)."""
+    positions = []
+    while len(positions) < count:
+        cycle = list(range(load))
+        rng.shuffle(cycle)
+        positions.extend(cycle)
+    return positions[:count]
+
+
+def build_block(conditions, items, rng=random):
+    """
+    Builds a balanced block in a single pass (no retry-until-balanced loops).
+
+    conditions: (load, snr) per trial, in presentation order.
+    items: the stimulus items to draw from (digits, letters, words).
+    Within each load x SNR cell: match/lure is exactly 50/50 (odd cells
+    alternate which side gets the extra trial), items and lures are dealt
+    from per-cell decks of item indices so their usage is even, and match
+    probes cycle through serial positions. If no lure is possible
+    (load == number of items), the probe is a match.
+
+    Returns: list of (load, snr, sequence, probe, is_match).
+    """
+    items = list(items)
+    counts = {}
+    for cond in conditions:
+        counts[cond] = counts.get(cond, 0) + 1
+
+    cells = {}
+    extra_match = True
+    for (load, snr), count in counts.items():
+        lures_possible = load < len(items)
+        if lures_possible:
+            flags = _match_flags(count, extra_match, rng)
+            if count % 2:
+                extra_match = not extra_match
+        else:
+            flags = [True] * count
+        n_match = sum(flags)
+        cells[(load, snr)] = {
+            'flags': iter(flags),
+            'positions': iter(_cycled_positions(n_match, load, rng)),
+            'seq_deck': _Deck(len(items), rng),
+            'lure_deck': _Deck(len(items), rng),
+        }
+
+    block = []
+    for load, snr in conditions:
+        cell = cells[(load, snr)]
+        seq = cell['seq_deck'].draw(load)
+        is_match = next(cell['flags'])
+        if is_match:
+            probe = seq[next(cell['positions'])]
+        else:
+            seq_mask = 0
+            for i in seq:
+                seq_mask |= 1 << i
+            probe = cell['lure_deck'].draw_excluding(seq_mask)
+        block.append((load, snr, [items[i] for i in seq], items[probe], is_match))
+    return block
@@ -0,0 +1,59 @@
+import random
+import secrets
+
+import numpy as np
+
+# spawn_key position of each block: streams are keyed (session,), (session, block) and (session, block, trial)
+BLOCK_KEYS = {'Practice': 0, 'Main': 1}
+# Root seeds fit a signed 64-bit column (CSV, SQLite INTEGER)
+ROOT_SEED_BITS = 63
+
+
+def new_root_seed():
+    """A fresh random root seed for a session."""
+    return secrets.randbits(ROOT_SEED_BITS)
+
+
+def seed_sequence(root_seed, *key):
+    """
+    The SeedSequence for `key` under root_seed. SeedSequence(root, spawn_key=key) is the
+    child that spawning along that path would give, but it is built directly, so any
+    process can rebuild any block's or trial's stream, in any order.
+    """
+    return np.random.SeedSequence(int(root_seed), spawn_key=tuple(int(k) for k in key))
+
+
+def _random(seq):
+    # The schedule and splicer use the `random` API; seed it with 256 bits of the stream
+    return random.Random(int.from_bytes(seq.generate_state(8).tobytes(), 'little'))
+
+
+def block_random(root_seed, session, block):
+    """random.Random for generating one block's trials."""
+    return _random(seed_sequence(root_seed, session, BLOCK_KEYS[block]))
+
+
+def trial_seed(root_seed, session, block, trial_num):
+    """Picklable, comparable handle of one trial's stream, as passed to the renderers."""
+    return (int(root_seed), int(session), BLOCK_KEYS[block], int(trial_num))
+
+
+def trial_seed_of(trial):
+    """trial_seed of a trial record (its seed, session, block and trial_num fields)."""
+    return trial_seed(trial['seed'], trial['session'], trial['block'], trial['trial_num'])
+
+
+def trial_rng(seed):
+    """np.random.Generator for a trial_seed (None: fresh OS entropy)."""
+    if seed is None:
+        return np.random.default_rng()
+    root_seed, *key = seed
+    return np.random.Generator(np.random.PCG64(seed_sequence(root_seed, *key)))
+
+
+def trial_random(seed):
+    """random.Random for a trial_seed (None: fresh OS entropy)."""
+    if seed is None:
+        return random.Random()
+    root_seed, *key = seed
+    return _random(seed_sequence(root_seed, *key))
@@ -0,0 +1,238 @@
+import argparse
+import base64
+import io
+import random
+import sys
+
+import numpy as np
+from pydub import AudioSegment
+
+from audio_manager import (
+    DIGITS, SAMPLE_RATE, TRIAL_SPEECH_DBFS, _samples_to_segment, create_trial_audio, generate_noise_samples,
+    get_digit_samples, render_trial_tracks
+)
+from seeding import trial_random, trial_seed
+
+# MPEG-1 Layer III frame length in samples
+MP3_FRAME = 1152
+# LAME prepends this many samples, so input is shifted to keep pieces on frame boundaries
+ENCODER_DELAY = 576
+# Noise frames encoded between pieces so each piece's edge frames see noise, not silence
+CONTEXT_FRAMES = 2
+# Independent realizations of each noise-only piece, so repeated ISIs are not identical
+NOISE_VARIANTS = 4
+MP3_BITRATE = "128k"
+# Bit reservoir off: every frame holds its own data and can be cut/concatenated freely
+ENCODE_PARAMS = ['-write_xing', '0', '-id3v2_version', '0', '-reservoir', '0']
+
+_BITRATES = {
+    1: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],    # MPEG-1 Layer III
+    2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],        # MPEG-2/2.5 Layer III
+}
+_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def split_mp3_frames(data):
+    """Splits a Layer III stream into its frames (skipping any ID3 tags)."""
+    pos = 0
+    if data[:3] == b"ID3":
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        pos = 10 + size
+    frames = []
+    while pos + 4 <= len(data):
+        b1, b2 = data[pos + 1], data[pos + 2]
+        if data[pos] != 0xFF or (b1 & 0xE0) != 0xE0:
+            break
+        version = (b1 >> 3) & 0x3
+        bitrate = _BITRATES[1 if version == 3 else 2][b2 >> 4] * 1000
+        sample_rate = _SAMPLE_RATES[version][(b2 >> 2) & 0x3]
+        padding = (b2 >> 1) & 0x1
+        length = (144 if version == 3 else 72) * bitrate // sample_rate + padding
+        frames.append(data[pos:pos + length])
+        pos += length
+    return frames
+
+
+def _encode_frames(samples):
+    buf = io.BytesIO()
+    _samples_to_segment(samples).export(buf, format="mp3", codec="libmp3lame", bitrate=MP3_BITRATE, parameters=ENCODE_PARAMS)
+    return split_mp3_frames(buf.getvalue())
+
+
+def _n_frames(duration_ms):
+    return max(1, int(round(SAMPLE_RATE * duration_ms / 1000 / MP3_FRAME)))
+
+
+class SegmentBank:
+    """
+    Pre-encoded, frame-aligned MP3 pieces for one language and timing setup.
+    A trial is assembled by concatenating frames: no decode, mix or encode per trial.
+
+    Pieces per SNR: noise lead-in, ISI fill and retention fill (NOISE_VARIANTS each),
+    and every digit in noise for every load. Durations are rounded to whole
+    frames (26.1 ms); a digit piece is its clip padded with noise to the next frame, and the
+    ISI and retention fills are shortened by the average padding, so timing does not drift with load.
+    The digit gain for a load is the full-mix gain of an average sequence of that
+    load, since the per-sequence gain cannot be known in advance.
+    The noise comes from `seed`, so every process builds the same pieces and a trial
+    assembled with a seeded rng (seeding.trial_random) is the same in any of them.
+    """
+    def __init__(self, lang, isi_ms, retention_ms, noise_onset_ms=2000, digits=DIGITS, loads=(2, 4, 6), snrs=(10, 5, 0), seed=0):
+        self.lang = lang
+        self._rng = np.random.default_rng(seed)
+        self.isi_ms = isi_ms
+        self.retention_ms = retention_ms
+        self.noise_onset_ms = noise_onset_ms
+        self.digits = list(digits)
+        self.loads = sorted(loads)
+        clip_lens = [len(get_digit_samples(d, lang)) for d in self.digits]
+        padding_ms = np.mean([-(-n // MP3_FRAME) * MP3_FRAME - n for n in clip_lens]) * 1000 / SAMPLE_RATE
+        self.frame_counts = {
+            'lead': _n_frames(noise_onset_ms),
+            'isi': _n_frames(isi_ms - padding_ms),
+            'retention': _n_frames(retention_ms - padding_ms),
+        }
+        self.pieces = {}
+        for snr in snrs:
+            self._encode_snr(snr)
+
+    def _noise(self, n, rms):
+        noise = generate_noise_samples(n * 1000 / SAMPLE_RATE + 1, self.lang, self._rng)[:n]
+        return noise * (rms / np.sqrt(np.mean(noise ** 2)))
+
+    def _speech_gain(self, load):
+        # Full-mix rule (speech stream at TRIAL_SPEECH_DBFS, ISIs included) for an average sequence
+        clips = [get_digit_samples(d, self.lang) for d in self.digits]
+        mean_energy = np.mean([np.sum(c.astype(np.float64) ** 2) for c in clips])
+        mean_len = np.mean([len(c) for c in clips])
+        isi = SAMPLE_RATE * self.isi_ms / 1000
+        stream_rms = np.sqrt(mean_energy * load / (mean_len * load + isi * (load - 1)))
+        return 10 ** (TRIAL_SPEECH_DBFS / 20) / stream_rms
+
+    def _encode_snr(self, snr):
+        noise_rms = 10 ** ((TRIAL_SPEECH_DBFS - snr) / 20)
+        pieces = []
+        for name in ('lead', 'isi', 'retention'):
+            for v in range(NOISE_VARIANTS):
+                pieces.append(((name, v), self._noise(self.frame_counts[name] * MP3_FRAME, noise_rms)))
+        for load in self.loads:
+            gain = self._speech_gain(load)
+            for d in self.digits:
+                clip = get_digit_samples(d, self.lang)
+                n = -(-len(clip) // MP3_FRAME) * MP3_FRAME
+                pcm = self._noise(n, noise_rms)
+                pcm[:len(clip)] += clip * gain
+                pieces.append((('digit', load, d), pcm))
+
+        # One encode per SNR: [context][piece][context][piece]...; the first context is
+        # short by ENCODER_DELAY so every piece starts exactly on an output frame
+        parts = [self._noise(CONTEXT_FRAMES * MP3_FRAME - ENCODER_DELAY, noise_rms)]
+        layout = []
+        pos = CONTEXT_FRAMES
+        for key, pcm in pieces:
+            parts.append(pcm)
+            layout.append((key, pos, len(pcm) // MP3_FRAME))
+            pos += len(pcm) // MP3_FRAME
+            parts.append(self._noise(CONTEXT_FRAMES * MP3_FRAME, noise_rms))
+            pos += CONTEXT_FRAMES
+        frames = _encode_frames(np.concatenate(parts))
+
+        for key, start, count in layout:
+            self.pieces[(snr,) + key] = (b"".join(frames[start:start + count]), count)
+
+    def _load_key(self, load):
+        return min(self.loads, key=lambda l: abs(l - load))
+
+    def assemble(self, digits_list, snr_db, rng=random):
+        """
+        Concatenates pre-encoded frames for a trial.
+        Returns: base64 encoded audio string (mp3) and its duration in ms.
+        """
+        load = self._load_key(len(digits_list))
+        variant = lambda: rng.randrange(NOISE_VARIANTS)
+        parts = [self.pieces[(snr_db, 'lead', variant())]]
+        for i, d in enumerate(digits_list):
+            parts.append(self.pieces[(snr_db, 'digit', load, d)])
+            if i < len(digits_list) - 1:
+                parts.append(self.pieces[(snr_db, 'isi', variant())])
+        parts.append(self.pieces[(snr_db, 'retention', variant())])
+
+        data = b"".join(p[0] for p in parts)
+        duration_ms = int(round(sum(p[1] for p in parts) * MP3_FRAME * 1000 / SAMPLE_RATE))
+        return base64.b64encode(data).decode(), duration_ms
+
+
+def _decode(b64):
+    seg = AudioSegment.from_file(io.BytesIO(base64.b64decode(b64)), format="mp3")
+    return np.array(seg.set_channels(1).get_array_of_samples(), dtype=np.float32) / 32768.0
+
+
+def check_against_reference(bank, digits_list, snr_db, tolerance_db=1.5, seed=None):
+    """
+    Compares a spliced trial with the full-mix render of the same sequence (create_trial_audio,
+    decoded, so both have been through the MP3 codec), with the trial's seed (seeding.trial_seed).
+    Returns a dict of errors and 'ok'. Durations may differ by the frame rounding
+    of each piece; levels (noise lead-in and speech stream) must agree within tolerance_db.
+    """
+    b64, duration_ms = bank.assemble(digits_list, snr_db, rng=trial_random(seed))
+    spliced = _decode(b64)
+
+    reference_b64, reference_ms = create_trial_audio(digits_list, snr_db, bank.isi_ms, bank.retention_ms, bank.lang,
+                                                     bank.noise_onset_ms, seed=seed)
+    reference = _decode(reference_b64)
+    _, _, start, end = render_trial_tracks(digits_list, snr_db, bank.isi_ms, bank.retention_ms, bank.lang, bank.noise_onset_ms)
+
+    def level(x):
+        return 10 * np.log10(np.mean(np.square(x, dtype=np.float64)))
+
+    # Stay clear of region edges, which move by up to a frame (and by the codec delay)
+    margin = 2 * MP3_FRAME
+    lead_end = bank.frame_counts['lead'] * MP3_FRAME
+    noise_error = level(spliced[margin:lead_end - margin]) - level(reference[margin:start - margin])
+    spliced_speech_end = len(spliced) - bank.frame_counts['retention'] * MP3_FRAME
+    speech_error = level(spliced[lead_end + margin:spliced_speech_end - margin]) - level(reference[start + margin:end - margin])
+
+    duration_error_ms = duration_ms - reference_ms
+    n = len(digits_list)
+    # Rounding: lead, ISIs and retention by up to half a frame, digits by up to one frame
+    max_duration_error_ms = ((n - 1 + 2) / 2 + n) * MP3_FRAME * 1000 / SAMPLE_RATE
+
+    return {
+        'duration_error_ms': float(duration_error_ms),
+        'noise_level_error_db': float(noise_error),
+        'speech_level_error_db': float(speech_error),
+        'ok': bool(abs(duration_error_ms) <= max_duration_error_ms
+                   and abs(noise_error) <= tolerance_db
+                   and abs(speech_error) <= tolerance_db),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check spliced trials against the full-mix render.")
+    parser.add_argument('--trials', type=int, default=10, help="Random sequences per load x SNR")
+    parser.add_argument('--lang', default='English')
+    parser.add_argument('--isi', type=int, default=800, help="ISI in ms")
+    parser.add_argument('--retention', type=int, default=2000, help="Retention in ms")
+    parser.add_argument('--tolerance', type=float, default=1.5, help="Max |level error| in dB")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    loads, snrs = (2, 4, 6), (10, 5, 0)
+    bank = SegmentBank(args.lang, args.isi, args.retention, loads=loads, snrs=snrs)
+    rng = random.Random(args.seed)
+    ok = True
+    print(f"{'load':>4} {'snr':>4} {'noise err':>9} {'max':>6} {'speech err':>10} {'max':>6} {'dur err ms':>10} {'max':>6}")
+    for snr in snrs:
+        for load in loads:
+            results = [check_against_reference(bank, rng.sample(bank.digits, load), snr, args.tolerance,
+                                               seed=trial_seed(args.seed, 1, 'Main', 1000 * load + i))
+                       for i in range(args.trials)]
+            ok = ok and all(r['ok'] for r in results)
+            cols = [np.array([r[k] for r in results]) for k in ('noise_level_error_db', 'speech_level_error_db', 'duration_error_ms')]
+            print(f"{load:>4} {snr:>4} " + " ".join(f"{c.mean():>{w}.2f} {np.abs(c).max():>6.2f}" for c, w in zip(cols, (9, 10, 10))))
+    print(f"{args.trials * len(loads) * len(snrs)} trials: {'PASS' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import argparse
+import ast
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from audio_manager import DIGITS, create_trial_audio, get_digit_b64
+from experiment_logic import ExperimentLogic
+from listener import SimulatedListener
+from results_store import DEFAULT_DB_NAME, ResultsStore
+from seeding import trial_random, trial_seed_of
+from trial_table import COLUMNS
+
+try:
+    import resource
+except ImportError:  # Windows: ffmpeg child CPU is not counted
+    resource = None
+
+RENDER_MODES = ['full', 'fast', 'stream']
+RESULTS_BACKENDS = ['csv', 'sqlite']
+
+
+def _cpu_seconds():
+    """CPU time of this process plus its waited-for children (ffmpeg encodes)."""
+    cpu = time.process_time()
+    if resource is not None:
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        cpu += children.ru_utime + children.ru_stime
+    return cpu
+
+
+def _make_renderer(mode, lang, isi_ms, retention_ms):
+    if mode == 'full':
+        return lambda t: create_trial_audio(t['digits'], t['snr'], isi_ms, retention_ms, lang, seed=trial_seed_of(t))[0]
+    if mode == 'fast':
+        from segment_splicer import SegmentBank
+        bank = SegmentBank(lang, isi_ms, retention_ms)
+        return lambda t: bank.assemble(t['digits'], t['snr'], rng=trial_random(trial_seed_of(t)))[0]
+    if mode == 'stream':
+        from stream_server import iter_trial_mp3
+        return lambda t: b"".join(iter_trial_mp3(t['digits'], t['snr'], isi_ms, retention_ms, lang, seed=trial_seed_of(t)))
+    raise ValueError(f"Unknown render mode: {mode}")
+
+
+def run_session(subject_id, session_num, out_dir, render='full', lang='English', isi_ms=800, retention_ms=2000,
+                loads=(2, 4, 6), snrs=(10, 5, 0), main_reps=22, num_practice=3, randomize=True, seed=0, listener=None,
+                results='csv'):
+    """
+    Runs one session as app.py would, without a browser or the phase sleeps:
+    every trial is rendered, its probe fetched, answered by the listener and autosaved
+    (CSV or the shared SQLite store), and the final CSV is published.
+
+    Returns: dict with the session's paths, trial count, render/CPU/wall seconds
+    and the problems found in the final CSV (empty if correct).
+    """
+    listener = listener or SimulatedListener(rng=random.Random(seed + 1))
+    wall0 = time.perf_counter()
+    cpu0 = _cpu_seconds()
+
+    renderer = _make_renderer(render, lang, isi_ms, retention_ms)
+    # The seed is the session's root seed: same trials and noise for the same seed and session number
+    logic = ExperimentLogic(subject_id, session_num, DIGITS, 0, seed=seed)
+    practice, main = logic.generate_trials(loads=list(loads), snrs=list(snrs), main_reps=main_reps,
+                                           num_practice=num_practice, randomize=randomize)
+
+    autosave = logic.autosave_filename(out_dir)
+    store = ResultsStore(os.path.join(out_dir, DEFAULT_DB_NAME)) if results == 'sqlite' else None
+    render_times = []
+    answered = []
+    for trial in list(practice) + list(main):
+        t0 = time.perf_counter()
+        renderer(trial)
+        render_times.append(time.perf_counter() - t0)
+        get_digit_b64(trial['probe'], lang)
+
+        response, rt = listener.respond(trial)
+        trial['response'] = 'Yes' if response else 'No'
+        trial['is_correct'] = trial['is_match'] == response
+        trial['rt'] = rt
+        answered.append(trial)
+        if store is not None:
+            store.save_trial(trial)
+        else:
+            logic.save_trial(trial, autosave)
+
+    final = os.path.join(out_dir, f"AuditoryMemoryTest_{subject_id}_sess{session_num}_final.csv")
+    if store is not None:
+        store.export_csv(final, subject_id, session_num, run_id=logic.run_id, results=answered)
+        store.close()
+    else:
+        logic.finalize_export(autosave, final, results=answered)
+
+    cpu = _cpu_seconds() - cpu0
+    wall = time.perf_counter() - wall0
+    valid_loads = [l for l in loads if l <= len(DIGITS)]
+    return {
+        'subject_id': subject_id,
+        'final_path': final,
+        'trials': len(practice) + len(main),
+        'render_s': render_times,
+        'cpu_s': cpu,
+        'wall_s': wall,
+        'problems': check_output(final, len(practice), len(snrs) * len(valid_loads) * main_reps, main_reps),
+    }
+
+
+def check_output(path, n_practice, n_main, main_reps):
+    """Checks a final CSV against the design and the responses. Returns a list of problems."""
+    problems = []
+    df = pd.read_csv(path)
+    if list(df.columns) != COLUMNS:
+        problems.append(f"columns {list(df.columns)} != {COLUMNS}")
+        return problems
+
+    counts = df['block'].value_counts()
+    if counts.get('Practice', 0) != n_practice or counts.get('Main', 0) != n_main:
+        problems.append(f"{counts.get('Practice', 0)} practice / {counts.get('Main', 0)} main rows, "
+                        f"expected {n_practice} / {n_main}")
+
+    for block, rows in df.groupby('block', sort=False):
+        if rows['trial_num'].tolist() != list(range(1, len(rows) + 1)):
+            problems.append(f"{block}: trial numbers out of order")
+
+    digits = df['digits'].map(ast.literal_eval)
+    if (digits.map(len) != df['load']).any():
+        problems.append("sequence length != load")
+    in_seq = pd.Series([p in d for p, d in zip(df['probe'], digits)], index=df.index)
+    if (in_seq != df['is_match']).any():
+        problems.append("is_match does not agree with the sequence")
+    if not df['response'].isin(['Yes', 'No']).all():
+        problems.append("missing responses")
+    if ((df['response'] == 'Yes') == df['is_match']).ne(df['is_correct']).any():
+        problems.append("is_correct does not agree with the response")
+    if not (df['rt'] > 0).all():
+        problems.append("non-positive RTs")
+
+    main_counts = df[df['block'] == 'Main'].groupby(['load', 'snr']).size()
+    if (main_counts != main_reps).any():
+        problems.append(f"unbalanced conditions: {main_counts.to_dict()}")
+    return problems
+
+
+def _run_one(kwargs):
+    return run_session(**kwargs)
+
+
+def simulate(n_sessions=4, workers=None, out_dir=None, seed=0, **session_kwargs):
+    """Runs n_sessions simulated participants across worker processes. Returns (results, wall seconds)."""
+    out_dir = out_dir or tempfile.mkdtemp(prefix="amt_sim_")
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [dict(session_kwargs, subject_id=f"SIM{i + 1:03d}", session_num=1, out_dir=out_dir, seed=seed + i)
+            for i in range(n_sessions)]
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        results = list(pool.map(_run_one, jobs))
+    return results, time.perf_counter() - t0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run simulated participants through the full pipeline and report throughput.")
+    parser.add_argument('--sessions', type=int, default=4)
+    parser.add_argument('--workers', type=int, default=None, help="Processes (default: one per CPU)")
+    parser.add_argument('--render', choices=RENDER_MODES, default='full')
+    parser.add_argument('--results', choices=RESULTS_BACKENDS, default='csv', help="Autosave backend")
+    parser.add_argument('--reps', type=int, default=22, help="Main repetitions per condition")
+    parser.add_argument('--practice', type=int, default=3)
+    parser.add_argument('--lang', default='English')
+    parser.add_argument('--isi', type=int, default=800, help="ISI in ms")
+    parser.add_argument('--retention', type=int, default=2000, help="Retention in ms")
+    parser.add_argument('--out', default=None, help="Output directory (default: a new temp dir)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results, wall = simulate(args.sessions, args.workers, args.out, args.seed, render=args.render, lang=args.lang,
+                             isi_ms=args.isi, retention_ms=args.retention, main_reps=args.reps,
+                             num_practice=args.practice, results=args.results)
+
+    trials = sum(r['trials'] for r in results)
+    render_ms = np.array([t for r in results for t in r['render_s']]) * 1000
+    cpu_ms = 1000 * sum(r['cpu_s'] for r in results) / trials
+    failed = [r for r in results if r['problems']]
+
+    print(f"{args.sessions} sessions x {trials // args.sessions} trials ({args.render} render, {args.results} results) in {wall:.1f}s")
+    print(f"  throughput: {trials / wall:8.1f} trials/s")
+    print(f"  CPU:        {cpu_ms:8.1f} ms/trial")
+    print(f"  render:     {render_ms.mean():8.1f} ms mean | {np.percentile(render_ms, 95):8.1f} ms p95")
+    for r in failed:
+        print(f"  {r['subject_id']}: " + "; ".join(r['problems']))
+    print(f"Output in {os.path.dirname(results[0]['final_path'])}: {'FAIL' if failed else 'PASS'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+"""
+Verifies the audio each render mode delivers, decoded from its MP3, against the full render.
+
+Every trial is rendered as the app would (create_trial_audio, the segment splicer or the
+stream endpoint), decoded, and measured:
+  active-speech SNR  speech power over its active 10 ms frames (the clips' gain in the decoded mix)
+                     vs the power of the rest of the mix, compared with the same measure on the
+                     unencoded mix of render_trial_tracks (the definition), and with the target the
+                     requested SNR sets (see expected_active_snr)
+  clipping           decoded samples at full scale
+  duration           decoded length vs the duration the app schedules the probe by
+Results are reduced per load x SNR as the trials go, so memory does not grow with --trials.
+
+    python snr_verify.py [--mode full|fast|stream] [--trials N] [--tolerance DB]
+"""
+import argparse
+import base64
+import subprocess
+import sys
+import time
+
+import numpy as np
+import scipy.fft
+from pydub import AudioSegment
+
+from audio_manager import SAMPLE_RATE, RenderContext, create_trial_audio, get_digit_samples, render_trial_tracks
+from experiment_logic import ExperimentLogic
+from seeding import trial_random, trial_rng, trial_seed
+
+RENDER_MODES = ['full', 'fast', 'stream']
+# Active speech: 10 ms frames within this many dB of the loudest frame of the trial
+ACTIVE_FRAME_MS = 10
+ACTIVE_THRESHOLD_DB = -35.0
+# Noise power leaves out this much at either end of the trial (encoder delay and padding)
+NOISE_MARGIN_MS = 100
+# Encoder + decoder delay searched when aligning a decoded trial with its timeline
+MAX_DELAY_MS = 150
+# Decoded audio may run past its reported duration by the encoder's padding to whole MPEG-1
+# Layer III frames (1152 samples) plus the decoder's flush: up to two frames
+MAX_DURATION_ERROR_MS = 2 * 1152 * 1000 / SAMPLE_RATE
+# Default |active SNR error| per mode. The full render shares the reference's noise, so only the
+# MP3 shows up in the error. The stream and the splicer draw their own noise (blocks, pieces), which the
+# speech-shaped projection picks up: about +-0.5 dB at 0 dB SNR. The splicer also uses one speech
+# gain per load (see SegmentBank), so a sequence louder or quieter than its load's average misses by more.
+TOLERANCE_DB = {'full': 0.5, 'stream': 1.0, 'fast': 1.5}
+# Max |mean active SNR - expected_active_snr| of a load x SNR condition (any mode)
+TARGET_TOLERANCE_DB = 0.5
+
+
+def _decode_mp3(data):
+    """Decodes MP3 bytes to mono float32 samples at SAMPLE_RATE with one ffmpeg call."""
+    proc = subprocess.run(
+        [AudioSegment.converter, "-loglevel", "error", "-i", "pipe:0", "-f", "s16le", "-ac", "1", "-ar", str(SAMPLE_RATE), "pipe:1"],
+        input=data, capture_output=True, check=True
+    )
+    return np.frombuffer(proc.stdout, dtype=np.int16)
+
+
+def _full_timeline(digits, isi_ms, lang, noise_onset_ms):
+    """Clip onsets (samples) of render_trial_tracks: the noise lead-in, then clips separated by the ISI."""
+    isi = int(SAMPLE_RATE * isi_ms / 1000)
+    starts, pos = [], int(SAMPLE_RATE * noise_onset_ms / 1000)
+    for d in digits:
+        starts.append(pos)
+        pos += len(get_digit_samples(d, lang)) + isi
+    return starts
+
+
+def _make_renderer(mode, lang, isi_ms, retention_ms, noise_onset_ms):
+    """
+    Returns render(trial, seed) -> (mp3 bytes, duration_ms the app uses, clip onsets in samples).
+    """
+    full_timeline = lambda digits: _full_timeline(digits, isi_ms, lang, noise_onset_ms)
+
+    if mode == 'full':
+        def render(t, seed):
+            b64, duration_ms = create_trial_audio(t['digits'], t['snr'], isi_ms, retention_ms, lang, noise_onset_ms, seed=seed)
+            return base64.b64decode(b64), duration_ms, full_timeline(t['digits'])
+        return render
+    if mode == 'stream':
+        from stream_server import iter_trial_mp3, trial_duration_ms
+
+        def render(t, seed):
+            mp3 = b"".join(iter_trial_mp3(t['digits'], t['snr'], isi_ms, retention_ms, lang, noise_onset_ms, seed=seed))
+            return mp3, trial_duration_ms(t['digits'], isi_ms, retention_ms, lang, noise_onset_ms), full_timeline(t['digits'])
+        return render
+    if mode == 'fast':
+        from segment_splicer import MP3_FRAME, SegmentBank
+        bank = SegmentBank(lang, isi_ms, retention_ms, noise_onset_ms)
+
+        def render(t, seed):
+            b64, duration_ms = bank.assemble(t['digits'], t['snr'], rng=trial_random(seed))
+            # Pieces are whole frames: the lead-in, each clip padded to a frame, the ISI fill
+            starts, pos = [], bank.frame_counts['lead'] * MP3_FRAME
+            for d in t['digits']:
+                starts.append(pos)
+                pos += -(-len(get_digit_samples(d, lang)) // MP3_FRAME) * MP3_FRAME + bank.frame_counts['isi'] * MP3_FRAME
+            return base64.b64decode(b64), duration_ms, starts
+        return render
+    raise ValueError(f"Unknown render mode: {mode}")
+
+
+def _frame_power(x, frame):
+    n = len(x) // frame
+    x = x[:n * frame].reshape(n, frame)
+    return np.einsum('ij,ij->i', x, x, dtype=np.float64) / frame
+
+
+def _placed_speech(starts, clips):
+    """The clean speech timeline (unscaled clips at their onsets), for alignment and the active-frame mask."""
+    placed = np.zeros(starts[-1] + len(clips[-1]), dtype=np.float32)
+    for pos, clip in zip(starts, clips):
+        placed[pos:pos + len(clip)] = clip
+    return placed
+
+
+def _active_snr(mix, placed):
+    """
+    Active-speech SNR (dB) of a mix whose speech follows `placed`. The speech gain is the projection
+    of the mix onto the clip timeline (the noise is uncorrelated with it); speech power is taken over
+    the timeline's active frames, noise power over the whole trial with the speech subtracted
+    (leaving out NOISE_MARGIN_MS at either end, where the encoder pads).
+    """
+    frame = int(SAMPLE_RATE * ACTIVE_FRAME_MS / 1000)
+    n = min(len(mix), len(placed))
+    gain = float(np.dot(mix[:n], placed[:n])) / float(np.dot(placed, placed))
+    mask = _frame_power(placed, frame)
+    active = mask > mask.max() * 10 ** (ACTIVE_THRESHOLD_DB / 10)
+    speech = gain ** 2 * mask[active].mean()
+
+    margin = int(SAMPLE_RATE * NOISE_MARGIN_MS / 1000)
+    residual = mix[margin:len(mix) - margin].astype(np.float64)
+    residual[:n - margin] -= gain * placed[margin:n]
+    noise = np.dot(residual, residual) / len(residual)
+    return 10 * np.log10(speech / noise)
+
+
+def expected_active_snr(snr, digits, lang, isi_ms):
+    """
+    Active-speech SNR (dB) a trial at `snr` should have. The renderers set the speech RMS over
+    the whole speech stream, ISIs included, to TRIAL_SPEECH_DBFS and the noise to
+    TRIAL_SPEECH_DBFS - snr, so speech measured over its active frames sits above the requested
+    SNR by the ratio of its active-frame power to the stream power: about 3-4 dB at an 800 ms ISI,
+    more at longer ones. Computed from the clean clips alone, not from any renderer.
+    """
+    clips = [get_digit_samples(d, lang) for d in digits]
+    placed = _placed_speech(_full_timeline(digits, isi_ms, lang, 0), clips)
+    stream_power = float(np.dot(placed, placed)) / len(placed)
+    frames = _frame_power(placed, int(SAMPLE_RATE * ACTIVE_FRAME_MS / 1000))
+    active_power = frames[frames > frames.max() * 10 ** (ACTIVE_THRESHOLD_DB / 10)].mean()
+    return snr + 10 * np.log10(active_power / stream_power)
+
+
+def measure_trial(decoded, starts, reference_mix, reference_starts, digits, lang):
+    """
+    Measures one decoded trial. `starts` are the clip onsets of the mode's timeline;
+    reference_mix is speech + noise of render_trial_tracks for the same trial (clips at reference_starts),
+    measured the same way.
+
+    Returns: dict with active_snr_db (decoded), reference_snr_db, delay (samples), duration_ms, clipped.
+    """
+    clips = [get_digit_samples(d, lang) for d in digits]
+    placed = _placed_speech(starts, clips)
+
+    x = decoded.astype(np.float32) / 32768
+    # Delay: lag (within MAX_DELAY_MS) at which the speech timeline best matches the decoded mix
+    max_delay = int(SAMPLE_RATE * MAX_DELAY_MS / 1000)
+    n_fft = scipy.fft.next_fast_len(len(x) + len(placed), real=True)
+    corr = scipy.fft.irfft(scipy.fft.rfft(x, n_fft) * np.conj(scipy.fft.rfft(placed, n_fft)), n_fft)[:max_delay + 1]
+    delay = int(np.argmax(corr))
+    x = x[delay:]
+
+    return {
+        'active_snr_db': float(_active_snr(x, placed)),
+        'reference_snr_db': float(_active_snr(reference_mix, _placed_speech(reference_starts, clips))),
+        'delay': delay,
+        'duration_ms': len(x) * 1000 / SAMPLE_RATE,
+        'clipped': int(np.count_nonzero((decoded >= 32767) | (decoded <= -32768))),
+    }
+
+
+class _ConditionStats:
+    """Running reductions of one load x SNR cell."""
+    def __init__(self):
+        self.n = 0
+        self.err_sum = 0.0
+        self.err_sq = 0.0
+        self.err_max = 0.0
+        self.snr_sum = 0.0
+        self.expected_sum = 0.0
+        self.clipped = 0
+        self.duration_max = 0.0
+
+    def add(self, err, active_snr, expected_snr, clipped, duration_err):
+        self.n += 1
+        self.err_sum += err
+        self.err_sq += err * err
+        self.err_max = max(self.err_max, abs(err))
+        self.snr_sum += active_snr
+        self.expected_sum += expected_snr
+        self.clipped += clipped
+        self.duration_max = max(self.duration_max, abs(duration_err))
+
+
+def verify(n_trials=1000, mode='full', isi_ms=800, retention_ms=2000, lang='English', noise_onset_ms=2000, tolerance_db=None, seed=0):
+    """
+    Renders n_trials from the standard design in `mode` and checks the decoded audio.
+    Returns (rows, ok): ok is False if any trial misses the reference active-speech SNR by more
+    than tolerance_db (default: TOLERANCE_DB of the mode), clips, or is longer or shorter than
+    its reported duration by more than MAX_DURATION_ERROR_MS, or if a condition's mean active
+    SNR misses the requested SNR's target (expected_active_snr) by more than TARGET_TOLERANCE_DB.
+    """
+    tolerance_db = TOLERANCE_DB[mode] if tolerance_db is None else tolerance_db
+    logic = ExperimentLogic('VERIFY', 1, range(1, 10), 0, seed=seed)
+    design = list(logic.generate_trials(num_practice=0, randomize=True)[1])
+    render = _make_renderer(mode, lang, isi_ms, retention_ms, noise_onset_ms)
+    ctx = RenderContext()
+
+    stats = {}
+    for i in range(n_trials):
+        t = design[i % len(design)]
+        # Trial i gets the stream of main trial i + 1, so repeats of the design get fresh noise
+        trial = trial_seed(seed, 1, 'Main', i + 1)
+        mp3, duration_ms, starts = render(t, trial)
+        speech, noise, _, _ = render_trial_tracks(t['digits'], t['snr'], isi_ms, retention_ms, lang, noise_onset_ms,
+                                                  ctx=ctx, rng=trial_rng(trial))
+        reference_mix = np.add(speech, noise, out=ctx.mix[:len(speech)])
+        m = measure_trial(_decode_mp3(mp3), starts, reference_mix, _full_timeline(t['digits'], isi_ms, lang, noise_onset_ms),
+                          t['digits'], lang)
+        stats.setdefault((t['load'], t['snr']), _ConditionStats()).add(
+            m['active_snr_db'] - m['reference_snr_db'], m['active_snr_db'], expected_active_snr(t['snr'], t['digits'], lang, isi_ms),
+            m['clipped'], m['duration_ms'] - duration_ms)
+
+    rows = []
+    for (load, snr), s in sorted(stats.items(), key=lambda c: (-c[0][1], c[0][0])):
+        mean = s.err_sum / s.n
+        rows.append({
+            'load': load,
+            'snr': snr,
+            'n': s.n,
+            'snr_error_mean': mean,
+            'snr_error_std': float(np.sqrt(max(s.err_sq / s.n - mean * mean, 0.0))),
+            'snr_error_max': s.err_max,
+            'active_snr_mean': s.snr_sum / s.n,
+            'expected_snr_mean': s.expected_sum / s.n,
+            'target_error': (s.snr_sum - s.expected_sum) / s.n,
+            'clipped': s.clipped,
+            'duration_error_max_ms': s.duration_max,
+        })
+    ok = all(r['snr_error_max'] <= tolerance_db and abs(r['target_error']) <= TARGET_TOLERANCE_DB and r['clipped'] == 0 and r['duration_error_max_ms'] <= MAX_DURATION_ERROR_MS
+             for r in rows)
+    return rows, ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Verify the active-speech SNR, clipping and duration of decoded trial audio.")
+    parser.add_argument('--mode', choices=RENDER_MODES, default='full', help="Render path to verify")
+    parser.add_argument('--trials', type=int, default=1000)
+    parser.add_argument('--lang', default='English')
+    parser.add_argument('--isi', type=int, default=800, help="ISI in ms")
+    parser.add_argument('--retention', type=int, default=2000, help="Retention in ms")
+    parser.add_argument('--tolerance', type=float, default=None, help="Max |active SNR error| in dB (default: per mode)")
+    args = parser.parse_args(argv)
+
+    t0 = time.perf_counter()
+    rows, ok = verify(args.trials, args.mode, args.isi, args.retention, args.lang, tolerance_db=args.tolerance)
+    elapsed = time.perf_counter() - t0
+
+    print(f"{'load':>4} {'snr':>4} {'n':>5} {'err mean':>9} {'err std':>8} {'err max':>8} {'active SNR':>10} {'expected':>8} {'clipped':>8} {'dur err ms':>10}")
+    for r in rows:
+        print(f"{r['load']:>4} {r['snr']:>4.0f} {r['n']:>5} {r['snr_error_mean']:>9.3f} {r['snr_error_std']:>8.3f} "
+              f"{r['snr_error_max']:>8.3f} {r['active_snr_mean']:>10.2f} {r['expected_snr_mean']:>8.2f} {r['clipped']:>8} {r['duration_error_max_ms']:>10.3f}")
+    print(f"{args.trials} {args.mode} trials in {elapsed:.1f}s: {'PASS' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import argparse
+import json
+import os
+import struct
+
+import numpy as np
+
+from seeding import seed_sequence
+
+# File layout: MAGIC | uint64 index size | JSON index | padding | float32 samples
+MAGIC = b"AMTBANK1"
+ALIGN = 64
+DEFAULT_NOISE_SEC = 60
+# Root seed of the noise beds (one stream per language), so a rebuilt bank has the same noise
+NOISE_SEED = 0
+
+
+class StimulusBank:
+    """
+    Read-only view of a packed stimulus bank file.
+    Samples are np.memmap'ed, so every process on the host shares one copy through
+    the OS page cache and opening the bank costs a file open, not a decode.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a stimulus bank")
+            (index_size,) = struct.unpack("<Q", f.read(8))
+            self.index = json.loads(f.read(index_size).decode("utf-8"))
+        self.sample_rate = self.index['sample_rate']
+        self._data = np.memmap(path, dtype=np.float32, mode='r', offset=self.index['data_offset'])
+
+    def _entry(self, name):
+        entry = self.index['entries'].get(name)
+        if entry is None:
+            return None
+        return self._data[entry['offset']:entry['offset'] + entry['length']]
+
+    def clip(self, lang_code, digit):
+        """Decoded digit clip (float32, read-only), or None if not in the bank."""
+        return self._entry(f"{lang_code}/{digit}")
+
+    def noise(self, lang_code):
+        """Unit-RMS speech-shaped noise for the language (float32, read-only), or None."""
+        return self._entry(f"{lang_code}/noise")
+
+
+def build_bank(path, langs=None, digits=None, noise_sec=DEFAULT_NOISE_SEC, noise_seed=NOISE_SEED):
+    """
+    Decodes (and preprocesses) every language's digit clips plus a long noise bed and packs them into one file.
+    Each language's bed is drawn from noise_seed (keyed by the language), so the trials rendered from
+    a bank, seeded or not, do not depend on which build of it a host has; the seed is kept in the index.
+    The file is written next to `path` and renamed into place, so readers never see a partial bank.
+    """
+    import audio_manager as am
+    langs = list(am.LANG_MAP) if langs is None else langs
+    digits = am.DIGITS if digits is None else digits
+
+    arrays = {}
+    for lang in langs:
+        code = am.LANG_MAP[lang]
+        for d in digits:
+            clip = am.get_digit_samples(d, lang)
+            if clip is not None:
+                arrays[f"{code}/{d}"] = clip
+        # Keyed by the language code's characters, so a bed does not change with the languages built alongside it
+        rng = np.random.default_rng(seed_sequence(noise_seed, *code.encode("ascii")))
+        noise = am.generate_noise_samples(noise_sec * 1000, lang, rng)
+        arrays[f"{code}/noise"] = noise / np.sqrt(np.mean(noise.astype(np.float64) ** 2))
+
+    entries = {}
+    offset = 0
+    for name, arr in arrays.items():
+        entries[name] = {'offset': offset, 'length': len(arr)}
+        offset += len(arr)
+
+    index = {'sample_rate': am.SAMPLE_RATE, 'clip_preprocess': am.CLIP_PREPROCESS_VERSION, 'noise_seed': noise_seed,
+             'entries': entries, 'data_offset': 0}
+    # The data offset depends on the index size, which depends on the data offset
+    header_size = len(MAGIC) + 8 + len(json.dumps(index)) + 32
+    index['data_offset'] = -(-header_size // ALIGN) * ALIGN
+    index_bytes = json.dumps(index).encode("utf-8")
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(index_bytes)))
+        f.write(index_bytes)
+        f.write(b"\0" * (index['data_offset'] - f.tell()))
+        for arr in arrays.values():
+            f.write(np.ascontiguousarray(arr, dtype=np.float32).tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+
+def main(argv=None):
+    import audio_manager as am
+    parser = argparse.ArgumentParser(description="Pack decoded digit clips and noise into a shared stimulus bank.")
+    parser.add_argument('--out', default=am.STIMULUS_BANK_PATH)
+    parser.add_argument('--noise-sec', type=int, default=DEFAULT_NOISE_SEC)
+    args = parser.parse_args(argv)
+    path = build_bank(args.out, noise_sec=args.noise_sec)
+    print(f"Wrote {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    main()
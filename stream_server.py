@@ -0,0 +1,258 @@
+import json
+import os
+import random
+import shutil
+import subprocess
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+
+from audio_manager import LANG_MAP, SAMPLE_RATE, TRIAL_SPEECH_DBFS, RenderContext, get_digit_energy, get_digit_samples, has_digit_clip
+from seeding import trial_rng
+
+STREAM_HOST = os.environ.get("AMT_STREAM_HOST", "127.0.0.1")
+STREAM_PORT = int(os.environ.get("AMT_STREAM_PORT", "8765"))
+# PCM rendered per step; audible onset latency is bounded by one chunk (plus encoder lookahead)
+CHUNK_MS = 100
+# Noise is synthesized per trial in blocks of this length, each crossfaded into the next
+NOISE_BLOCK_MS = 1000
+NOISE_FADE_MS = 50
+# HTTP chunk size for the encoded stream
+READ_SIZE = 4096
+# Accepted request parameters (the app's settings, with margin); anything else gets a 400
+MAX_ITEMS = 12
+MAX_ITEM_CHARS = 64
+ISI_RANGE_MS = (0, 5000)
+RETENTION_RANGE_MS = (0, 10000)
+ONSET_RANGE_MS = (0, 5000)
+SNR_RANGE_DB = (-30.0, 40.0)
+# Streams encoding at once (one ffmpeg each); more get a 503
+MAX_STREAMS = 8
+_streams = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def _noise_blocks(lang, rng):
+    """
+    Endless unit-RMS speech-shaped noise (RenderContext.noise_samples), yielded in blocks of
+    NOISE_BLOCK_MS - NOISE_FADE_MS. Every block is drawn afresh from rng, and its start is
+    crossfaded with equal-power ramps into the end of the one before, so the noise neither
+    repeats nor clicks at the joins.
+    """
+    ctx = RenderContext(NOISE_BLOCK_MS, rng)
+    size = int(SAMPLE_RATE * NOISE_BLOCK_MS / 1000)
+    fade = int(SAMPLE_RATE * NOISE_FADE_MS / 1000)
+    ramp = np.sin(0.5 * np.pi * (np.arange(fade) + 0.5) / fade).astype(np.float32)
+    tail = None
+    while True:
+        noise = ctx.noise_samples(size, lang, rng)
+        block = noise / np.float32(np.sqrt(np.dot(noise, noise) / size))
+        if tail is not None:
+            block[:fade] = block[:fade] * ramp + tail * ramp[::-1]
+        tail = block[size - fade:]
+        yield block[:size - fade]
+
+
+def _timeline(digits_list, isi_ms, lang, noise_onset_ms):
+    """Clip placements [(start_sample, clip)] and the speech stream's (start, end)."""
+    onset = int(SAMPLE_RATE * noise_onset_ms / 1000)
+    isi = int(SAMPLE_RATE * isi_ms / 1000)
+    events = []
+    pos = onset
+    for d in digits_list:
+        clip = get_digit_samples(d, lang)
+        if clip is None:
+            clip = np.zeros(int(SAMPLE_RATE * 0.5), dtype=np.float32)
+        events.append((pos, clip))
+        pos += len(clip) + isi
+    end = pos - isi if events else onset
+    return events, onset, end
+
+
+def trial_duration_ms(digits_list, isi_ms, retention_ms, lang='English', noise_onset_ms=2000):
+    """Duration of the streamed trial, known without rendering it."""
+    _, _, end = _timeline(digits_list, isi_ms, lang, noise_onset_ms)
+    return (end + int(SAMPLE_RATE * retention_ms / 1000)) * 1000 / SAMPLE_RATE
+
+
+def iter_trial_pcm(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000, chunk_ms=CHUNK_MS, seed=None):
+    """
+    Renders the trial as 16-bit PCM chunks of chunk_ms, noise lead-in first.
+    Levels follow create_trial_audio (speech stream at TRIAL_SPEECH_DBFS with ISIs included,
+    noise at TRIAL_SPEECH_DBFS - snr_db), with the speech gain worked out from the clip
+    energies up front, so memory stays constant in the trial length.
+    The noise is synthesized as it goes (see _noise_blocks) from the trial's stream
+    (seeding.trial_rng of the trial_seed), so no two trials share a noise bed.
+    """
+    events, start, end = _timeline(digits_list, isi_ms, lang, noise_onset_ms)
+    total = end + int(SAMPLE_RATE * retention_ms / 1000)
+
+    energy = sum(get_digit_energy(d, lang) for d in digits_list)
+    speech_rms = 10 ** (TRIAL_SPEECH_DBFS / 20)
+    if energy > 0:
+        speech_gain = speech_rms / np.sqrt(energy / (end - start))
+        noise_gain = 10 ** ((TRIAL_SPEECH_DBFS - snr_db) / 20)
+    else:
+        speech_gain = 0.0
+        noise_gain = speech_rms
+
+    noise = _noise_blocks(lang, trial_rng(seed))
+    block, block_pos = next(noise), 0
+    chunk = int(SAMPLE_RATE * chunk_ms / 1000)
+    buf = np.empty(chunk, dtype=np.float32)
+
+    for a in range(0, total, chunk):
+        b = min(a + chunk, total)
+        out = buf[:b - a]
+        # Noise bed, moving on to the next block where this one runs out
+        n = 0
+        while n < len(out):
+            if block_pos == len(block):
+                block, block_pos = next(noise), 0
+            take = min(len(out) - n, len(block) - block_pos)
+            np.multiply(block[block_pos:block_pos + take], noise_gain, out=out[n:n + take])
+            n += take
+            block_pos += take
+        # Speech clips overlapping this chunk
+        for pos, clip in events:
+            lo, hi = max(a, pos), min(b, pos + len(clip))
+            if lo < hi:
+                out[lo - a:hi - a] += clip[lo - pos:hi - pos] * speech_gain
+        np.clip(out, -1.0, 32767 / 32768, out=out)
+        yield (out * 32768).astype(np.int16).tobytes()
+
+
+def iter_trial_mp3(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000, seed=None):
+    """Encodes iter_trial_pcm progressively through one ffmpeg process; yields MP3 bytes as produced."""
+    ffmpeg = shutil.which("ffmpeg") or "ffmpeg"
+    proc = subprocess.Popen(
+        [ffmpeg, "-loglevel", "error", "-f", "s16le", "-ar", str(SAMPLE_RATE), "-ac", "1", "-i", "pipe:0",
+         "-f", "mp3", "-codec:a", "libmp3lame", "-b:a", "128k", "-flush_packets", "1", "pipe:1"],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+
+    def feed():
+        try:
+            for pcm in iter_trial_pcm(digits_list, snr_db, isi_ms, retention_ms, lang, noise_onset_ms, seed=seed):
+                proc.stdin.write(pcm)
+        except (BrokenPipeError, ValueError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        while True:
+            data = proc.stdout.read1(READ_SIZE)
+            if not data:
+                break
+            yield data
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+        feeder.join()
+
+
+def _in_range(value, bounds):
+    if not bounds[0] <= value <= bounds[1]:
+        raise ValueError(f"{value} outside {bounds}")
+    return value
+
+
+def _parse_items(text, lang):
+    """Items of a JSON list (digits as ints, letters/words as strings) whose clips are already available."""
+    items = json.loads(text)
+    if not isinstance(items, list) or not 0 < len(items) <= MAX_ITEMS:
+        raise ValueError("items")
+    for item in items:
+        if isinstance(item, bool) or not isinstance(item, (int, str)) or len(str(item)) > MAX_ITEM_CHARS:
+            raise ValueError("items")
+        # Requests never trigger gTTS: the app loads a trial's clips before handing out its URL
+        if not has_digit_clip(item, lang):
+            raise ValueError(f"no clip for {item!r}")
+    return items
+
+
+class TrialStreamHandler(BaseHTTPRequestHandler):
+    """GET /trial?items=[1,2,3]&snr=5&isi=800&retention=2000&lang=English&onset=2000[&seed=root,session,block,trial] (items URL-encoded JSON)"""
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/trial":
+            self.send_error(404)
+            return
+        try:
+            q = {k: v[0] for k, v in parse_qs(url.query).items()}
+            lang = q.get('lang', 'English')
+            if lang not in LANG_MAP:
+                raise ValueError("lang")
+            digits = _parse_items(q['items'], lang)
+            args = (digits, _in_range(float(q['snr']), SNR_RANGE_DB), _in_range(int(q['isi']), ISI_RANGE_MS),
+                    _in_range(int(q['retention']), RETENTION_RANGE_MS), lang, _in_range(int(q.get('onset', 2000)), ONSET_RANGE_MS))
+            seed = tuple(int(k) for k in q['seed'].split(',')) if q.get('seed') else None
+            if seed is not None and (len(seed) != 4 or min(seed) < 0):
+                raise ValueError("seed")
+        except (KeyError, ValueError):
+            self.send_error(400, "Expected items, snr, isi and retention within the accepted ranges")
+            return
+        if not _streams.acquire(blocking=False):
+            self.send_error(503, "Too many streams")
+            return
+        try:
+            self._stream(args, seed)
+        finally:
+            _streams.release()
+
+    def _stream(self, args, seed):
+        self.send_response(200)
+        self.send_header("Content-Type", "audio/mpeg")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.send_header("Cache-Control", "no-store")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        try:
+            for data in iter_trial_mp3(*args, seed=seed):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Browser went away (e.g. the next rerun replaced the player)
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stream_server(host=STREAM_HOST, port=STREAM_PORT):
+    """
+    Starts the streaming endpoint on a daemon thread and returns the server (local only by default:
+    it is unauthenticated and every request runs an encoder). Port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer((host, port), TrialStreamHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def trial_stream_url(digits_list, snr_db, isi_ms, retention_ms, lang='English', noise_onset_ms=2000, host=STREAM_HOST, port=STREAM_PORT, seed=None):
+    """URL the browser loads to stream a trial (the nonce keeps it from being cached)."""
+    params = {
+        'items': json.dumps(list(digits_list)),
+        'snr': snr_db,
+        'isi': isi_ms,
+        'retention': retention_ms,
+        'lang': lang,
+        'onset': noise_onset_ms,
+        'n': random.getrandbits(32),
+    }
+    if seed is not None:
+        params['seed'] = ','.join(str(k) for k in seed)
+    query = urlencode(params)
+    return f"http://{host}:{port}/trial?{query}"
@@ -0,0 +1,61 @@
+import os
+
+import audio_manager
+
+
+class _FakeTTS:
+    """Stands in for gTTS (no network): writes the requested text as the 'mp3'."""
+    texts = []
+
+    def __init__(self, text, lang, slow):
+        self.text = text
+        _FakeTTS.texts.append(text)
+
+    def save(self, filename):
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(self.text)
+
+
+def test_digit_assets_keep_their_names(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_manager, 'ASSETS_DIR', str(tmp_path))
+    assert audio_manager._asset_path(7, 'English') == os.path.join(str(tmp_path), "en_7.mp3")
+    assert audio_manager._asset_path('B', 'English') == os.path.join(str(tmp_path), "en_B.mp3")
+
+
+def test_item_text_is_made_safe_for_the_asset_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(audio_manager, 'ASSETS_DIR', str(tmp_path))
+    monkeypatch.setattr(audio_manager, 'gTTS', _FakeTTS)
+    word = "what/is: it?"
+    path = audio_manager._asset_path(word, 'English')
+    assert os.path.dirname(path) == str(tmp_path)
+    assert not set("/:? ") & set(os.path.basename(path))
+    # Same characters kept, different text: different asset
+    assert path != audio_manager._asset_path("what is it", 'English')
+    assert path != audio_manager._asset_path("what?is: it/", 'English')
+
+    assert not audio_manager.has_digit_clip(word, 'English')
+    assert audio_manager.get_digit_path(word, 'English') == path
+    assert _FakeTTS.texts[-1] == word
+    assert audio_manager.has_digit_clip(word, 'English')
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+
+
+def test_render_contexts_are_reused_across_threads():
+    import threading
+
+    seen = []
+
+    def render():
+        with audio_manager.render_context() as ctx:
+            seen.append(ctx)
+
+    # Sequential reruns on new threads (as Streamlit does) share one context
+    for _ in range(3):
+        t = threading.Thread(target=render)
+        t.start()
+        t.join()
+    assert seen[0] is seen[1] is seen[2]
+
+    # Renders at the same time each get their own
+    with audio_manager.render_context() as a, audio_manager.render_context() as b:
+        assert a is not b
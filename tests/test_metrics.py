@@ -0,0 +1,36 @@
+import urllib.request
+
+import metrics
+from experiment_logic import CSV_WRITE_FAILURES, ExperimentLogic
+
+
+def _serve(port, fallbacks=metrics.METRICS_PORT_FALLBACKS):
+    return metrics.start_metrics_server('127.0.0.1', port, fallbacks)
+
+
+def test_metrics_server_falls_back_when_the_port_is_taken():
+    first = _serve(0)
+    taken = first.server_address[1]
+    servers = [first]
+    try:
+        servers.append(_serve(taken))
+        servers.append(_serve(taken, fallbacks=0))
+        ports = [s.server_address[1] for s in servers]
+        assert len(set(ports)) == 3
+        for port in ports[1:]:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as r:
+                assert r.status == 200
+    finally:
+        for s in servers:
+            s.shutdown()
+            s.server_close()
+
+
+def test_failed_trial_save_is_counted(tmp_path):
+    logic = ExperimentLogic('S1', 1, range(1, 10), 30, seed=0)
+    trial = logic.generate_trials(num_practice=0)[1][0]
+    before = CSV_WRITE_FAILURES.value(operation='trial')
+    assert not logic.save_trial(trial, str(tmp_path / "missing" / "trials.csv"))
+    assert CSV_WRITE_FAILURES.value(operation='trial') == before + 1
+    assert logic.save_trial(trial, str(tmp_path / "trials.csv"))
+    assert CSV_WRITE_FAILURES.value(operation='trial') == before + 1
@@ -0,0 +1,23 @@
+import os
+import sys
+import types
+
+from render_service import RenderService
+
+
+def test_workers_do_not_run_the_main_script(tmp_path, monkeypatch):
+    # Under Streamlit, __main__ is the app script (by __file__); a worker importing it would run the app
+    marker = tmp_path / "ran"
+    script = tmp_path / "app_script.py"
+    script.write_text(f"open({str(marker)!r}, 'w').close()\n")
+    main = types.ModuleType('__main__')
+    main.__file__ = str(script)
+    monkeypatch.setitem(sys.modules, '__main__', main)
+
+    service = RenderService(max_workers=1)
+    try:
+        worker_pid = service.submit('s', os.getpid).result(timeout=60)
+    finally:
+        service.shutdown()
+    assert worker_pid != os.getpid()
+    assert not marker.exists()
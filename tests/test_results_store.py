@@ -0,0 +1,54 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from experiment_logic import ExperimentLogic
+from results_store import ResultsStore
+
+
+def _answered_trials(n):
+    logic = ExperimentLogic('S1', 1, range(1, 10), 30, seed=0)
+    trials = list(logic.generate_trials(num_practice=0)[1])[:n]
+    for t in trials:
+        t['response'] = 'Yes'
+        t['is_correct'] = bool(t['is_match'])
+        t['rt'] = 1.25
+    return logic, trials
+
+
+def test_failed_save_is_exported_from_memory(tmp_path, monkeypatch):
+    logic, trials = _answered_trials(3)
+    store = ResultsStore(str(tmp_path / "failing.sqlite"))
+    insert = store._insert
+
+    def fail_second(rows):
+        if fail_second.calls == 1:
+            fail_second.calls += 1
+            raise sqlite3.OperationalError("database is locked")
+        fail_second.calls += 1
+        insert(rows)
+    fail_second.calls = 0
+    monkeypatch.setattr(store, '_insert', fail_second)
+
+    for i, t in enumerate(trials):
+        if i == 1:
+            with pytest.raises(sqlite3.OperationalError):
+                store.save_trial(t)
+        else:
+            store.save_trial(t)
+    assert len(store.query(run_id=logic.run_id)) == 2
+
+    final = store.export_csv(str(tmp_path / "final.csv"), 'S1', 1, run_id=logic.run_id, results=trials)
+    exported = pd.read_csv(final)
+    assert len(exported) == 3
+
+    # Same file as exporting a store that got every trial
+    complete = ResultsStore(str(tmp_path / "complete.sqlite"))
+    for t in trials:
+        complete.save_trial(t)
+    expected = complete.export_csv(str(tmp_path / "expected.csv"), 'S1', 1, run_id=logic.run_id, results=trials)
+    with open(final) as a, open(expected) as b:
+        assert a.read() == b.read()
+    store.close()
+    complete.close()
@@ -0,0 +1,28 @@
+import os
+import streamlit.components.v1 as components
+
+# Front-end that timestamps playback and button presses with performance.now()
+_FRONTEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "timing_frontend")
+_timing_capture = components.declare_component("timing_capture", path=_FRONTEND_DIR)
+
+def play_trial_audio(b64_audio, trial_key, src=None):
+    """Plays the trial audio (inline base64, or a stream URL) in the browser and records its playback onset there."""
+    _timing_capture(mode="audio", audio_b64=b64_audio, audio_src=src, trial_key=trial_key, key=f"audio_{trial_key}", default=None)
+
+def probe_response(probe_b64, trial_key, yes_label="YES (Match)", no_label="NO (Non-Match)"):
+    """
+    Plays the probe and shows the YES/NO buttons in the browser.
+    
+    Returns: None until a button is pressed, then a dict with 'response' (bool) and the
+    client timestamps (epoch ms): client_audio_onset, client_probe_onset,
+    client_probe_audio_onset, client_press.
+    """
+    return _timing_capture(
+        mode="response",
+        probe_b64=probe_b64,
+        trial_key=trial_key,
+        yes_label=yes_label,
+        no_label=no_label,
+        key=f"response_{trial_key}",
+        default=None
+    )
@@ -0,0 +1,281 @@
+import array
+import math
+import sys
+import time
+import tracemalloc
+from collections.abc import MutableMapping
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# Per-trial timing (epoch seconds, except rt_client in seconds); server clock vs browser clock
+TIMING_COLUMNS = ['rt_client', 'server_audio_sent', 'server_probe_sent', 'client_audio_onset', 'client_probe_onset', 'client_probe_audio_onset', 'client_press']
+
+# Column order of the exported CSV (same as the autosave files). seed is the root of the session's
+# random streams; with session, block and trial_num it rebuilds the trial (see seeding.py).
+# run_id tells runs of the same subject and session apart (see ExperimentLogic.run_id)
+COLUMNS = [
+    'timestamp', 'subject_id', 'session', 'block', 'trial_num', 'load', 'snr', 'digits', 'probe', 'is_match', 'response', 'is_correct', 'rt',
+    *TIMING_COLUMNS, 'seed', 'run_id',
+]
+
+# Timestamps are stored as local wall-clock microseconds since this epoch
+_EPOCH = datetime(1970, 1, 1)
+_ONE_US = timedelta(microseconds=1)
+
+RESPONSE_NAMES = ['No', 'Yes']
+
+
+class TrialRecord(MutableMapping):
+    """Dict-like view of one row of a TrialTable (reads and writes go to the table)."""
+    __slots__ = ('_table', '_index')
+
+    def __init__(self, table, index):
+        self._table = table
+        self._index = index
+
+    def __getitem__(self, key):
+        return self._table.get_value(self._index, key)
+
+    def __setitem__(self, key, value):
+        self._table.set_value(self._index, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("Trial fields cannot be deleted")
+
+    def __iter__(self):
+        return iter(self._table.columns)
+
+    def __len__(self):
+        return len(self._table.columns)
+
+    def __repr__(self):
+        return f"TrialRecord({dict(self)!r})"
+
+
+class TrialTable:
+    """
+    Compact, column-oriented store for one session's trials.
+    Session constants (subject_id, session, seed, run_id) are kept once; per-trial fields live in typed arrays.
+    Indexing returns TrialRecord views, so a table can stand in for a list of trial dicts.
+    Sequence items and probes are stored as small ints: the values themselves (digits), or,
+    with `items` (e.g. a letter or word vocabulary), indices into `items`.
+    """
+    # Per-trial columns and their array typecodes
+    FIELDS = {
+        'timestamp': 'q',   # microseconds since _EPOCH
+        'block': 'B',       # index into self.blocks
+        'trial_num': 'l',
+        'load': 'h',
+        'snr': 'h',
+        'probe': 'h',
+        'is_match': 'b',
+        'response': 'b',    # -1 = None, else index into RESPONSE_NAMES
+        'is_correct': 'b',  # -1 = None
+        'rt': 'd',          # NaN = None
+    }
+    FIELDS.update({name: 'd' for name in TIMING_COLUMNS})
+
+    def __init__(self, subject_id, session, items=None, seed=None, run_id=None):
+        self.subject_id = subject_id
+        self.session = session
+        self.seed = seed
+        self.run_id = run_id
+        self.items = list(items) if items is not None else None
+        self._item_codes = {item: i for i, item in enumerate(self.items)} if self.items is not None else None
+        self.columns = COLUMNS
+        self.blocks = []
+        self._cols = {name: array.array(code) for name, code in self.FIELDS.items()}
+        # Item codes need more than 16 bits only for very large vocabularies
+        item_code = 'h' if self.items is None or len(self.items) < 2 ** 15 else 'l'
+        self._cols['probe'] = array.array(item_code)
+        # Sequences are stored back to back; trial i is _digits[_offsets[i]:_offsets[i+1]]
+        self._digits = array.array(item_code)
+        self._offsets = array.array('l', [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [TrialRecord(self, i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("trial index out of range")
+        return TrialRecord(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield TrialRecord(self, i)
+
+    def append(self, block, trial_num, load, snr, digits, probe, is_match, timestamp=None):
+        """Adds a trial (with no response yet) and returns its record."""
+        if timestamp is None:
+            timestamp = datetime.now()
+        if block not in self.blocks:
+            self.blocks.append(block)
+
+        cols = self._cols
+        cols['timestamp'].append((timestamp - _EPOCH) // _ONE_US)
+        cols['block'].append(self.blocks.index(block))
+        cols['trial_num'].append(trial_num)
+        cols['load'].append(load)
+        cols['snr'].append(snr)
+        cols['probe'].append(self._encode(probe))
+        cols['is_match'].append(bool(is_match))
+        cols['response'].append(-1)
+        cols['is_correct'].append(-1)
+        cols['rt'].append(math.nan)
+        for name in TIMING_COLUMNS:
+            cols[name].append(math.nan)
+
+        self._digits.extend([self._encode(d) for d in digits])
+        self._offsets.append(len(self._digits))
+        return TrialRecord(self, len(self) - 1)
+
+    def _encode(self, item):
+        return item if self._item_codes is None else self._item_codes[item]
+
+    def _decode(self, code):
+        return code if self.items is None else self.items[code]
+
+    def get_value(self, index, key):
+        if key == 'subject_id':
+            return self.subject_id
+        if key == 'session':
+            return self.session
+        if key == 'seed':
+            return self.seed
+        if key == 'run_id':
+            return self.run_id
+        if key == 'digits':
+            return [self._decode(c) for c in self._digits[self._offsets[index]:self._offsets[index + 1]]]
+        if key not in self._cols:
+            raise KeyError(key)
+
+        value = self._cols[key][index]
+        if key == 'timestamp':
+            return str(_EPOCH + value * _ONE_US)
+        if key == 'block':
+            return self.blocks[value]
+        if key == 'probe':
+            return self._decode(value)
+        if key == 'is_match':
+            return bool(value)
+        if key == 'response':
+            return None if value < 0 else RESPONSE_NAMES[value]
+        if key == 'is_correct':
+            return None if value < 0 else bool(value)
+        if self.FIELDS[key] == 'd':
+            return None if math.isnan(value) else value
+        return value
+
+    def set_value(self, index, key, value):
+        if key in ('subject_id', 'session', 'seed', 'run_id'):
+            raise KeyError(f"'{key}' is a session constant")
+        if key == 'digits':
+            start, end = self._offsets[index], self._offsets[index + 1]
+            if len(value) != end - start:
+                raise ValueError("Sequence length cannot change")
+            self._digits[start:end] = array.array(self._digits.typecode, [self._encode(d) for d in value])
+            return
+        if key not in self._cols:
+            raise KeyError(key)
+
+        if key == 'timestamp':
+            value = (datetime.fromisoformat(value) if isinstance(value, str) else value)
+            value = (value - _EPOCH) // _ONE_US
+        elif key == 'block':
+            if value not in self.blocks:
+                self.blocks.append(value)
+            value = self.blocks.index(value)
+        elif key == 'probe':
+            value = self._encode(value)
+        elif key == 'response':
+            value = -1 if value is None else RESPONSE_NAMES.index(value)
+        elif key in ('is_match', 'is_correct'):
+            value = -1 if value is None else bool(value)
+        elif self.FIELDS[key] == 'd':
+            value = math.nan if value is None else value
+        self._cols[key][index] = value
+
+    def to_frame(self):
+        """Builds the export DataFrame column by column (digits already flattened to strings)."""
+        cols = {name: np.frombuffer(arr, dtype=arr.typecode) if len(arr) else np.array([], dtype=arr.typecode)
+                for name, arr in self._cols.items()}
+        n = len(self)
+        offsets = self._offsets
+        digits = self._digits
+        probes = cols['probe']
+        if self.items is not None:
+            digits = [self._decode(c) for c in digits]
+            probes = np.array(self.items, dtype=object)[probes] if n else probes
+
+        data = {
+            'timestamp': pd.Series(cols['timestamp'].astype('datetime64[us]')),
+            'subject_id': [self.subject_id] * n,
+            'session': [self.session] * n,
+            'block': pd.Categorical.from_codes(cols['block'].astype(np.int16), categories=self.blocks) if self.blocks else [],
+            'trial_num': cols['trial_num'],
+            'load': cols['load'],
+            'snr': cols['snr'],
+            'digits': [str(list(digits[offsets[i]:offsets[i + 1]])) for i in range(n)],
+            'probe': probes,
+            'is_match': cols['is_match'].astype(bool),
+            'response': pd.Categorical.from_codes(cols['response'], categories=RESPONSE_NAMES),
+            'is_correct': pd.arrays.BooleanArray(cols['is_correct'] == 1, cols['is_correct'] < 0),
+            'rt': cols['rt'],
+        }
+        for name in TIMING_COLUMNS:
+            data[name] = cols[name]
+        data['seed'] = [self.seed] * n
+        data['run_id'] = [self.run_id] * n
+        return pd.DataFrame(data, columns=self.columns)
+
+
+def _benchmark(n_trials=10000):
+    """Compares the legacy list-of-dicts trials with a TrialTable (memory and DataFrame conversion)."""
+    import random
+    rng = random.Random(0)
+    specs = []
+    for i in range(n_trials):
+        load = rng.choice([2, 4, 6])
+        seq = rng.sample(range(1, 10), load)
+        specs.append((i + 1, load, rng.choice([10, 5, 0]), seq, rng.randint(1, 9), rng.random() < 0.5))
+
+    tracemalloc.start()
+    dicts = []
+    for num, load, snr, seq, probe, is_match in specs:
+        dicts.append({
+            'timestamp': str(datetime.now()), 'subject_id': 'SUB001', 'session': 1, 'block': 'Main',
+            'trial_num': num, 'load': load, 'snr': snr, 'digits': list(seq), 'probe': probe,
+            'is_match': is_match, 'response': None, 'is_correct': None, 'rt': None
+        })
+    dict_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    table = TrialTable('SUB001', 1)
+    for num, load, snr, seq, probe, is_match in specs:
+        table.append('Main', num, load, snr, seq, probe, is_match)
+    table_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    t0 = time.perf_counter()
+    df = pd.DataFrame(dicts)
+    df['digits'] = df['digits'].apply(lambda x: str(x))
+    dict_df_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    table.to_frame()
+    table_df_s = time.perf_counter() - t0
+
+    print(f"{n_trials} trials")
+    print(f"  memory:    dicts {dict_bytes / 1e6:8.2f} MB | table {table_bytes / 1e6:8.2f} MB")
+    print(f"  DataFrame: dicts {dict_df_s * 1000:8.1f} ms | table {table_df_s * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    _benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,84 @@
+import os
+
+# Word lists (one item per line, '#' comments) found here are offered as vocabularies
+VOCABULARY_DIR = os.path.join("assets", "vocabularies")
+# Sidebar shows a checkbox grid up to this many items, a multiselect above it
+GRID_MAX_ITEMS = 30
+
+
+class Vocabulary:
+    """
+    An ordered set of stimulus items (digits, letters, words).
+    Items are addressed by their index in `items` (schedule deals indices, whatever the
+    vocabulary size). The audio for an item is the asset `<lang_code>_<item>.mp3`, with the
+    item's text made safe for a file name (see audio_manager._asset_name), generated with
+    gTTS from the text when missing and decoded on first use.
+    """
+    def __init__(self, name, items, noun='item'):
+        self.name = name
+        self.items = list(items)
+        # What one item is called in the instructions ("Was this digit in the sequence?")
+        self.noun = noun
+        self.index = {item: i for i, item in enumerate(self.items)}
+        self._by_text = {str(item): item for item in self.items}
+        if len(self.index) != len(self.items):
+            raise ValueError(f"Vocabulary '{name}' has duplicate items")
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __contains__(self, item):
+        return item in self.index
+
+    def coerce(self, item):
+        """Maps sidebar/CSV values back to items (e.g. '3' -> 3 for digits)."""
+        if item in self.index:
+            return item
+        try:
+            return self._by_text[str(item)]
+        except KeyError:
+            raise KeyError(f"{item!r} is not in vocabulary '{self.name}'") from None
+
+    @classmethod
+    def from_file(cls, path, name=None):
+        """Reads a word list: one item per line, blank lines and '#' comments ignored."""
+        with open(path, encoding="utf-8") as f:
+            items = [line.strip() for line in f if line.strip() and not line.lstrip().startswith("#")]
+        return cls(name or os.path.splitext(os.path.basename(path))[0], items, noun='word')
+
+
+DIGITS = Vocabulary('Digits', range(1, 10), noun='digit')
+# Consonants commonly used in letter span tasks (no vowels, so no words form)
+LETTERS = Vocabulary('Letters', "BCDFHJKLMNPQRSTVXZ", noun='letter')
+
+_registry = {v.name: v for v in (DIGITS, LETTERS)}
+
+
+def register_vocabulary(vocabulary):
+    _registry[vocabulary.name] = vocabulary
+    return vocabulary
+
+
+def list_vocabularies():
+    """Names of the registered vocabularies plus the word lists in VOCABULARY_DIR (not read yet)."""
+    names = list(_registry)
+    if os.path.isdir(VOCABULARY_DIR):
+        for filename in sorted(os.listdir(VOCABULARY_DIR)):
+            name, ext = os.path.splitext(filename)
+            if ext == ".txt" and name not in names:
+                names.append(name)
+    return names
+
+
+def get_vocabulary(name):
+    """Returns a registered vocabulary, reading a word list from VOCABULARY_DIR on first use."""
+    vocabulary = _registry.get(name)
+    if vocabulary is None:
+        path = os.path.join(VOCABULARY_DIR, f"{name}.txt")
+        if not os.path.exists(path):
+            raise KeyError(f"Unknown vocabulary '{name}'")
+        vocabulary = register_vocabulary(Vocabulary.from_file(path, name))
+    return vocabulary